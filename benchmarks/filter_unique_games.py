@@ -0,0 +1,79 @@
+"""
+Benchmark of filter_unique_games on synthetic catalogs of 2k, 20k and 100k titles, against the previous
+quadratic implementation on the smallest one. Run from the root of the repository with:
+
+    python -m benchmarks.filter_unique_games
+"""
+
+import random
+import string
+import time
+
+import pandas as pd
+
+from src.assign_games import filter_unique_games
+
+# Number of titles of the synthetic catalogs
+CATALOG_SIZES = [2_000, 20_000, 100_000]
+
+# Largest catalog on which the previous implementation is timed, as it is quadratic
+MAX_PREVIOUS_SIZE = 2_000
+
+
+def filter_unique_games_previous(games_df):
+    """
+    Previous implementation of filter_unique_games, comparing every pair of titles.
+
+    Args:
+        games_df (pd.DataFrame): The DataFrame containing a 'Title' column.
+
+    Returns:
+        pd.DataFrame: A filtered DataFrame containing only unique titles.
+    """
+    return games_df[
+        games_df["Title"].apply(
+            lambda x: not any(other in x for other in games_df["Title"] if x != other)
+        )
+    ].reset_index(drop=True)
+
+
+def synthetic_catalog(n_titles, rng):
+    """
+    Build a catalog of titles made of 1 to 4 words drawn from a vocabulary of 20k random words.
+
+    Args:
+        n_titles (int): Number of titles.
+        rng (random.Random): Random number generator.
+
+    Returns:
+        pd.DataFrame: The catalog, with a 'Title' column.
+    """
+    words = [
+        "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 9)))
+        for _ in range(20_000)
+    ]
+    return pd.DataFrame(
+        {"Title": [" ".join(rng.choices(words, k=rng.randint(1, 4))).title() for _ in range(n_titles)]}
+    )
+
+
+def main():
+    rng = random.Random(2)
+    for n_titles in CATALOG_SIZES:
+        games_df = synthetic_catalog(n_titles, rng)
+
+        start = time.perf_counter()
+        unique_games_df = filter_unique_games(games_df)
+        line = f"{n_titles:>7,} titles: {time.perf_counter() - start:6.2f}s"
+
+        if n_titles <= MAX_PREVIOUS_SIZE:
+            start = time.perf_counter()
+            previous_df = filter_unique_games_previous(games_df)
+            line += f" (previous implementation: {time.perf_counter() - start:.2f}s)"
+            assert previous_df.equals(unique_games_df)
+
+        print(f"{line}, {len(unique_games_df):,} unique titles")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,19 @@
 import pandas as pd
 import polars as pl
 import matplotlib.pyplot as plt
+import hashlib
+import json
+import multiprocessing
+import os
+import re
 import string
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
 from tqdm import tqdm
 
+from src.utils import collect_like
+
 def filter_and_sort_games_by_plays(games_df, cutoff=2000):
     """
     Converts 'Plays' to numeric, sorts games by play count, and limits the DataFrame to the top N rows.
@@ -62,7 +72,10 @@ def filter_games_by_title(games_df, words_path, min_title_length=4):
 
 def filter_unique_games(games_df):
     """
-    Removes rows where the 'Title' is a substring of any other 'Title' in the DataFrame.
+    Removes rows where the 'Title' contains any other 'Title' of the DataFrame as a substring.
+
+    The titles are matched with an Aho-Corasick automaton built over the whole catalog, so the
+    cost grows with the total length of the titles rather than with the square of their number.
 
     Args:
         games_df (pd.DataFrame): The DataFrame containing a 'Title' column.
@@ -70,18 +83,130 @@ def filter_unique_games(games_df):
     Returns:
         pd.DataFrame: A filtered DataFrame containing only unique titles.
     """
-    # Filter rows where 'Title' is not a substring of any other title
-    games_df = games_df[
-        games_df["Title"].apply(
-            lambda x: not any(other in x for other in games_df["Title"] if x != other)
+    # Index all distinct titles in a single automaton, so that each title is scanned once
+    titles = list(dict.fromkeys(games_df["Title"]))
+    automaton = build_automaton(titles)
+
+    # A title contains another one if it contains a strictly shorter title
+    def contains_other_title(title):
+        return any(
+            len(titles[index]) < len(title)
+            for output in iter_matches(title, automaton)
+            for index in output
         )
+
+    # Filter rows where another 'Title' is not a substring of 'Title'
+    games_df = games_df[
+        ~games_df["Title"].apply(contains_other_title).astype(bool)
     ].reset_index(drop=True)
 
     return games_df
 
 
+def parse_plays_expr(column: str = "Plays") -> pl.Expr:
+    """
+    Converts play counts such as "12.3K" or "850" to numbers, like filter_and_sort_games_by_plays.
+
+    Args:
+        column (str): Name of the column with the play counts. Defaults to 'Plays'.
+
+    Returns:
+        pl.Expr: Expression with the numeric play counts.
+    """
+    plays = pl.col(column).cast(pl.String)
+    return plays.str.replace_all("[kK]", "").cast(pl.Float64) * (
+        pl.when(plays.str.contains("[kK]")).then(1000).otherwise(1)
+    )
+
+
+def parse_genres_expr(column: str = "Genres") -> pl.Expr:
+    """
+    Converts the stringified genre lists of games.csv, such as "['Adventure', 'RPG']", to lists
+    of categorical genres.
+
+    Args:
+        column (str): Name of the column with the genres. Defaults to 'Genres'.
+
+    Returns:
+        pl.Expr: Expression with the genres as a List[Categorical].
+    """
+    return (
+        pl.col(column)
+        .str.split(",")
+        .list.eval(pl.element().str.strip_chars("[]' "))
+        .cast(pl.List(pl.Categorical))
+    )
+
+
+def build_games_catalog(
+    games_path, words_path, catalog_path, cutoff=2000, min_title_length=4
+) -> pl.DataFrame:
+    """
+    Builds the games catalog once and writes it as an uncompressed Arrow IPC file, which can then
+    be memory mapped with load_games_catalog. The catalog contains the games kept by
+    filter_and_sort_games_by_plays, filter_games_by_title and filter_unique_games, with:
+    - 'plays': the numeric play counts,
+    - 'processed_title': the titles processed by preprocess_name,
+    - 'Genres': the genres as a List[Categorical].
+
+    Args:
+        games_path (str): Path to games.csv.
+        words_path (str): Path to the file containing words to exclude (one per line).
+        catalog_path (str): Path of the catalog file to write.
+        cutoff (int): The number of most played games to retain. Defaults to 2000.
+        min_title_length (int): Minimum allowed length for titles. Defaults to 4.
+
+    Returns:
+        pl.DataFrame: The games catalog.
+    """
+    games_df = (
+        pd.read_csv(games_path, index_col=0)
+        .drop_duplicates("Title")
+        .reset_index(drop=True)
+    )
+    games_df = filter_and_sort_games_by_plays(games_df, cutoff=cutoff)
+    games_df = filter_games_by_title(games_df, words_path, min_title_length)
+    games_df = filter_unique_games(games_df)
+
+    catalog_df = pl.from_pandas(games_df).with_columns(
+        parse_plays_expr("Plays").alias("plays"),
+        preprocess_name_expr("Title").alias("processed_title"),
+        parse_genres_expr("Genres"),
+    )
+    catalog_df.write_ipc(catalog_path, compression="uncompressed")
+
+    return catalog_df
+
+
+def load_games_catalog(catalog_path) -> pl.DataFrame:
+    """
+    Loads the games catalog written by build_games_catalog, memory mapping the file.
+
+    Args:
+        catalog_path (str): Path of the catalog file.
+
+    Returns:
+        pl.DataFrame: The games catalog.
+    """
+    return pl.read_ipc(catalog_path, memory_map=True)
+
+
 """This file contains useful fuctions for the main notebook."""
 
+# Version of the rules implemented by match_game, to bump whenever they change
+MATCHING_RULES_VERSION = "title-first-then-unique-tag-v1"
+
+# Regex character class matching the characters removed by preprocess_name
+PUNCTUATION_PATTERN = "[" + re.escape(string.punctuation) + "]"
+
+# Capital sigmas that str.lower turns into a final sigma: preceded by a cased letter and not followed by one,
+# ignoring the case-ignorable characters in between (Unicode Final_Sigma condition)
+FINAL_SIGMA_PATTERN = (
+    r"([\p{Cased}--\p{Case_Ignorable}]\p{Case_Ignorable}*)"
+    r"Σ"
+    r"(\p{Case_Ignorable}*(?:[^\p{Cased}\p{Case_Ignorable}]|$))"
+)
+
 
 def preprocess_name(name: str) -> str:
     """
@@ -126,6 +251,142 @@ def map_to_game(title: str, tags: str, game_titles: list[str]) -> str:
         return None
 
 
+def preprocess_name_expr(column: str) -> pl.Expr:
+    """
+    Native Polars equivalent of preprocess_name, which runs multi-threaded instead of
+    calling back into Python for every row. Both produce the exact same strings: final
+    capital sigmas are turned into 'ς' beforehand, as str.to_lowercase does not always
+    apply the final sigma rule of str.lower.
+
+    Args:
+        column (str): Name of the column to process.
+
+    Returns:
+        pl.Expr: Expression with the processed column.
+    """
+    return (
+        pl.col(column)
+        .str.replace_all(FINAL_SIGMA_PATTERN, "${1}ς${2}")
+        .str.to_lowercase()
+        .str.replace_all(",", " ", literal=True)
+        .str.replace_all(PUNCTUATION_PATTERN, "")
+    )
+
+
+def build_automaton(patterns: list[str]) -> tuple[list[dict], list[int], list[tuple]]:
+    """
+    Compile a list of patterns into an Aho-Corasick automaton, so that all the patterns
+    contained in a text can be found in a single pass over it.
+
+    Args:
+        patterns (list[str]): The patterns to search for. Duplicates keep their own index.
+
+    Returns:
+        tuple[list[dict], list[int], list[tuple]]: The transitions, failure links and
+        matched pattern indices (including the ones reached through failure links) of
+        each node, the root being node 0.
+    """
+    goto = [{}]
+    outputs = [[]]
+
+    # Build the trie of all patterns
+    for index, pattern in enumerate(patterns):
+        node = 0
+        for char in pattern:
+            if char not in goto[node]:
+                goto[node][char] = len(goto)
+                goto.append({})
+                outputs.append([])
+            node = goto[node][char]
+        outputs[node].append(index)
+
+    # Compute failure links breadth-first and merge the outputs along them
+    fail = [0] * len(goto)
+    queue = deque(goto[0].values())
+    while queue:
+        node = queue.popleft()
+        outputs[node].extend(outputs[fail[node]])
+        for char, child in goto[node].items():
+            state = fail[node]
+            while state and char not in goto[state]:
+                state = fail[state]
+            fail[child] = goto[state].get(char, 0)
+            queue.append(child)
+
+    return goto, fail, [tuple(output) for output in outputs]
+
+
+def iter_matches(text: str, automaton: tuple):
+    """
+    Scan a text once and yield the indices of the patterns ending at each position.
+
+    Args:
+        text (str): The text to scan.
+        automaton (tuple): The automaton returned by build_automaton.
+
+    Yields:
+        tuple[int]: The indices of the patterns found, for every position where at least one ends.
+    """
+    goto, fail, outputs = automaton
+
+    # Empty patterns are contained in any text
+    if outputs[0]:
+        yield outputs[0]
+
+    node = 0
+    for char in text:
+        while node and char not in goto[node]:
+            node = fail[node]
+        node = goto[node].get(char, 0)
+        if outputs[node]:
+            yield outputs[node]
+
+
+def build_game_matcher(game_titles: list[str]) -> tuple[list[str], tuple]:
+    """
+    Compile the list of game titles into a matcher usable by match_game.
+
+    Args:
+        game_titles (list[str]): The processed game titles, by order of priority.
+
+    Returns:
+        tuple[list[str], tuple]: The game titles and their compiled automaton.
+    """
+    return list(game_titles), build_automaton(game_titles)
+
+
+def match_game(title: str, tags: str, matcher: tuple) -> str:
+    """
+    Map the video to a game based on the title and tags, with the same rules as map_to_game:
+    the first game (in the list order) found in the title wins, otherwise the video is only
+    assigned if exactly one game is found in the tags.
+
+    Args:
+        title (str): The processed title of the video.
+        tags (str): The processed tags of the video.
+        matcher (tuple): The matcher returned by build_game_matcher.
+
+    Returns:
+        str: Name of the game if the video is related to a game, else None.
+    """
+    game_titles, automaton = matcher
+
+    first_match = min(
+        (index for output in iter_matches(title, automaton) for index in output),
+        default=None,
+    )
+    if first_match is not None:
+        return game_titles[first_match]
+
+    matched_games = {
+        index for output in iter_matches(tags, automaton) for index in output
+    }
+    if len(matched_games) == 1:
+        return game_titles[matched_games.pop()]
+    else:
+        return None
+
+
 def w_pbar(pbar, func):
     """
     Add a progress bar to visuallize progress of a function.
@@ -145,19 +406,40 @@ def w_pbar(pbar, func):
     return foo
 
 
-def preprocess_video_data(videos_sample_df, games_df, preprocess_name):
+def preprocess_video_data(videos_sample_df, games_df, preprocess_name=None):
     """
     Applies the preprocess_name function to the 'title' and 'tags' columns of videos_sample_df,
     and to the 'Title' column of games_df.
 
     Args:
         videos_sample_df (pl.DataFrame): The DataFrame containing video information.
-        games_df (pd.DataFrame): The DataFrame containing game information.
-        preprocess_name (function): The preprocessing function to apply to titles and tags.
+        games_df (pd.DataFrame): The DataFrame containing game information, or the games catalog
+            (see build_games_catalog) whose processed titles are used as is.
+        preprocess_name (function): A custom preprocessing function to apply to titles and tags, called
+            for every row. Defaults to None, running preprocess_name as native Polars expressions
+            (see preprocess_name_expr).
 
     Returns:
         pl.DataFrame, list: The processed videos_sample_df and the list of processed game titles.
     """
+    if preprocess_name is None:
+        videos_sample_df = videos_sample_df.with_columns(
+            preprocess_name_expr("title"),
+            preprocess_name_expr("tags"),
+        )
+
+        # The games catalog already holds the processed titles
+        if isinstance(games_df, pl.DataFrame) and "processed_title" in games_df.columns:
+            game_titles = games_df.get_column("processed_title").to_list()
+        else:
+            game_titles = (
+                pl.DataFrame({"Title": pl.Series(games_df["Title"].to_list(), dtype=pl.String)})
+                .select(preprocess_name_expr("Title"))
+                .get_column("Title")
+                .to_list()
+            )
+        return videos_sample_df, game_titles
+
     # Apply the preprocessing function to 'title' and 'tags' columns of videos_sample_df
     videos_sample_df = videos_sample_df.with_columns(
         pl.col("title").map_elements(preprocess_name),
@@ -165,40 +447,211 @@ def preprocess_video_data(videos_sample_df, games_df, preprocess_name):
     )
 
     # Apply the preprocessing function to the 'Title' column of games_df and convert it to a list
-    game_titles = games_df["Title"].progress_apply(preprocess_name).tolist()
+    game_titles = pd.Series(games_df["Title"].to_list()).progress_apply(preprocess_name).tolist()
 
     return videos_sample_df, game_titles
 
 
-def classify_videos_with_games(videos_df, game_titles):
+# Matcher of the current worker process, compiled once by _init_classification_worker
+_worker_matcher = None
+
+
+def _init_classification_worker(game_titles: list[str]) -> None:
     """
-    Classifies videos by associating them with games based on titles and tags.
+    Compile the game matcher once in a worker process of the classification pool.
+
+    Args:
+        game_titles (list[str]): The processed game titles.
+    """
+    global _worker_matcher
+    _worker_matcher = build_game_matcher(game_titles)
+
+
+def _classify_batch(titles: list[str], tags: list[str]) -> tuple[int, list[str], float]:
+    """
+    Classify a batch of videos with the matcher of the current worker process.
+
+    Args:
+        titles (list[str]): The processed titles of the videos.
+        tags (list[str]): The processed tags of the videos.
+
+    Returns:
+        tuple[int, list[str], float]: The worker pid, the games of the videos and the time spent.
+    """
+    start = time.perf_counter()
+    video_games = [
+        match_game(title, video_tags, _worker_matcher)
+        for title, video_tags in zip(titles, tags)
+    ]
+    return os.getpid(), video_games, time.perf_counter() - start
+
+
+def assign_games_to_videos(
+    videos_df, game_titles, n_workers=1, batch_size=100_000
+) -> pl.Series:
+    """
+    Computes the game of every video, or None if no game could be associated with it.
+
+    With more than one worker, the videos are split in batches of rows which are classified
+    by a pool of processes, each compiling the game matcher once when it starts. At most two
+    batches per worker are in flight, only these being converted to Python lists.
 
     Args:
         videos_df (pl.DataFrame): The DataFrame containing 'title' and 'tags' columns.
         game_titles (list): A list of game titles for classification.
+        n_workers (int): Number of processes to use, None for one per CPU. Defaults to 1.
+        batch_size (int): Number of videos per batch sent to the workers. Defaults to 100 000.
 
     Returns:
-        pl.DataFrame: A DataFrame with a new 'video_game' column and no null values in 'video_game'.
+        pl.Series: The 'video_game' of each video, in the same order as videos_df.
     """
-    progress_bar = tqdm(total=len(videos_df), desc="Classifying videos")
+    if n_workers is None:
+        n_workers = os.cpu_count()
 
-    # Apply the mapping
-    with_game_df = videos_df.with_columns(
-        [
+    if n_workers == 1:
+        matcher = build_game_matcher(game_titles)
+        progress_bar = tqdm(total=len(videos_df), desc="Classifying videos")
+
+        # Apply the mapping
+        video_games = videos_df.select(
             pl.struct(["title", "tags"])
             .map_elements(
                 w_pbar(
                     progress_bar,
-                    lambda row: map_to_game(row["title"], row["tags"], game_titles),
+                    lambda row: match_game(row["title"], row["tags"], matcher),
                 ),
                 return_dtype=str,
             )
             .alias("video_game")
-        ]
-    ).drop_nulls(subset="video_game")
+        ).get_column("video_game")
+
+        progress_bar.close()
+        return video_games
+
+    results = [None] * -(-len(videos_df) // batch_size)
+    worker_rows = {}
+    worker_time = {}
+
+    def collect(future, index):
+        pid, video_games, elapsed = future.result()
+        results[index] = pl.Series("video_game", video_games, dtype=pl.String)
+        worker_rows[pid] = worker_rows.get(pid, 0) + len(video_games)
+        worker_time[pid] = worker_time.get(pid, 0) + elapsed
+        progress_bar.update(len(video_games))
+
+    with ProcessPoolExecutor(
+        max_workers=n_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_classification_worker,
+        initargs=(list(game_titles),),
+    ) as executor, tqdm(total=len(videos_df), desc="Classifying videos") as progress_bar:
+        futures = {}
+        for index, batch in enumerate(videos_df.select(["title", "tags"]).iter_slices(batch_size)):
+            # Keep at most two batches per worker in flight, converting each one only when it is submitted
+            if len(futures) >= 2 * n_workers:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(future, futures.pop(future))
+            futures[executor.submit(_classify_batch, batch["title"].to_list(), batch["tags"].to_list())] = index
+        for future in as_completed(futures):
+            collect(future, futures[future])
+
+    # Print the throughput of each worker
+    for pid, rows in worker_rows.items():
+        print(
+            f"Worker {pid}: {rows} videos in {worker_time[pid]:.1f}s "
+            f"({rows / max(worker_time[pid], 1e-9):,.0f} videos/s)"
+        )
 
-    progress_bar.close()
+    if not results:
+        return pl.Series("video_game", [], dtype=pl.String)
+    return pl.concat(results)
+
+
+def games_fingerprint(game_titles: list[str]) -> str:
+    """
+    Computes a fingerprint of the game titles and matching rules, which identifies the
+    game assignments that can be reused between runs.
+
+    Args:
+        game_titles (list[str]): The processed game titles, by order of priority.
+
+    Returns:
+        str: Hexadecimal fingerprint.
+    """
+    payload = json.dumps([MATCHING_RULES_VERSION, list(game_titles)])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def load_cached_games(videos_df, game_titles, cache_dir, n_workers=1, batch_size=100_000):
+    """
+    Computes the game of every video, reusing the assignments cached on disk for the same
+    games catalog and only classifying the display_ids that are not in the cache yet.
+
+    Args:
+        videos_df (pl.DataFrame): The DataFrame containing 'display_id', 'title' and 'tags' columns.
+        game_titles (list): A list of game titles for classification.
+        cache_dir (str): Directory of the cache files, one per games catalog fingerprint.
+        n_workers (int): Number of processes to use, None for one per CPU. Defaults to 1.
+        batch_size (int): Number of videos per batch sent to the workers. Defaults to 100 000.
+
+    Returns:
+        pl.DataFrame: The 'display_id' and 'video_game' (None when unassigned) of all the cached videos.
+    """
+    cache_path = os.path.join(
+        cache_dir, f"video_games_{games_fingerprint(game_titles)}.parquet"
+    )
+    if os.path.exists(cache_path):
+        cache_df = pl.read_parquet(cache_path)
+    else:
+        cache_df = pl.DataFrame(
+            schema={"display_id": videos_df.schema["display_id"], "video_game": pl.String}
+        )
+
+    # Only classify the videos that are not in the cache
+    new_videos_df = videos_df.join(cache_df, on="display_id", how="anti")
+    print(f"{len(videos_df) - len(new_videos_df)} videos found in the cache, {len(new_videos_df)} to classify")
+
+    if len(new_videos_df) > 0:
+        video_games = assign_games_to_videos(new_videos_df, game_titles, n_workers, batch_size)
+        new_cache_df = (
+            new_videos_df.select("display_id")
+            .with_columns(video_games)
+            .unique(subset="display_id", keep="first", maintain_order=True)
+        )
+        cache_df = pl.concat([cache_df, new_cache_df])
+
+        os.makedirs(cache_dir, exist_ok=True)
+        cache_df.write_parquet(cache_path)
+
+    return cache_df
+
+
+def classify_videos_with_games(
+    videos_df, game_titles, n_workers=1, batch_size=100_000, cache_dir=None
+):
+    """
+    Classifies videos by associating them with games based on titles and tags.
+
+    Args:
+        videos_df (pl.DataFrame): The DataFrame containing 'title' and 'tags' columns.
+        game_titles (list): A list of game titles for classification.
+        n_workers (int): Number of processes to use, None for one per CPU. Defaults to 1.
+        batch_size (int): Number of videos per batch sent to the workers. Defaults to 100 000.
+        cache_dir (str): If given, directory where the games of the videos are cached by 'display_id'
+            (see load_cached_games). Defaults to None.
+
+    Returns:
+        pl.DataFrame: A DataFrame with a new 'video_game' column and no null values in 'video_game'.
+    """
+    if cache_dir is None:
+        video_games = assign_games_to_videos(videos_df, game_titles, n_workers, batch_size)
+        with_game_df = videos_df.with_columns(video_games).drop_nulls(subset="video_game")
+    else:
+        cache_df = load_cached_games(videos_df, game_titles, cache_dir, n_workers, batch_size)
+        with_game_df = videos_df.join(cache_df, on="display_id", how="left").drop_nulls(
+            subset="video_game"
+        )
 
     # Print the classification percentage
     percentage = len(with_game_df) / len(videos_df) * 100
@@ -212,22 +665,26 @@ def get_top_game_per_channel(with_game_df, top_n=10):
     Computes the top game for each channel and returns the top N most frequent games across channels.
 
     Args:
-        with_game_df (pl.DataFrame): The DataFrame containing 'channel_id' and 'video_game' columns.
+        with_game_df (pl.DataFrame | pl.LazyFrame): The DataFrame containing 'channel_id' and 'video_game' columns.
         top_n (int): The number of top games to return based on frequency. Defaults to 10.
 
     Returns:
-        pl.DataFrame: A DataFrame containing the top N most frequent games and their counts.
+        pl.DataFrame | pl.LazyFrame: A DataFrame containing the top N most frequent games and their counts, lazy if the input is.
     """
-    # Group by channel_id and video_game, count plays, and sort within each channel
+    # Group by channel_id and video_game, count plays, and keep the most played game of each channel
     top_game_per_channel_df = (
-        with_game_df.group_by(["channel_id", "video_game"])
-        .agg(pl.count().alias("play_count"))
-        .sort(["channel_id", "play_count"], descending=True)
+        with_game_df.lazy().group_by(["channel_id", "video_game"])
+        .agg(pl.len().alias("play_count"))
         .group_by("channel_id")
-        .agg(pl.col("video_game").first().alias("top_game"))
+        .agg(
+            pl.col("video_game")
+            .sort_by(["play_count", "video_game"], descending=[True, False])
+            .first()
+            .alias("top_game")
+        )
     )
 
-    return top_game_per_channel_df
+    return collect_like(top_game_per_channel_df, with_game_df)
 
 
 def game_percentage(df: pl.DataFrame):
@@ -1,13 +1,20 @@
+import glob
+import os
+import shutil
 import polars as pl
 import pandas as pd
-from itertools import combinations
+import numpy as np
+from scipy import sparse
 from tqdm import tqdm
 import networkx as nx
 import community as community_louvain
 
+# Rough in-memory size of a comment row once read, used to size the batches of the out-of-core mode
+BYTES_PER_COMMENT = 100
+
 def get_target_mapping(
     videos_df: pl.DataFrame, channels_df: pl.DataFrame, target_type: str
-) -> dict:
+) -> pl.DataFrame:
     """
     Create a mapping from display_id to the target (game or channel name).
 
@@ -17,7 +24,7 @@ def get_target_mapping(
         target_type (str): Either 'game' or 'channel' to specify the target column.
 
     Returns:
-        dict: A dictionary mapping display_id to the target (game or channel name).
+        pl.DataFrame: A DataFrame with one row per 'display_id' and its target in a column named target_type.
     """
     # Ensure channels_df is a Polars DataFrame
     if isinstance(channels_df, pd.DataFrame):
@@ -35,9 +42,50 @@ def get_target_mapping(
     else:
         raise ValueError("Invalid target_type. Must be 'game' or 'channel'.")
 
-    # Convert to pandas and create the mapping
-    df = joined_df.to_pandas()
-    return dict(zip(df["display_id"], df[target_column]))
+    # Keep the last target of each display_id, as a dictionary would
+    return joined_df.rename({target_column: target_type}).unique(
+        subset="display_id", keep="last", maintain_order=True
+    )
+
+
+def get_targets_mapping(videos_df: pl.DataFrame, channels_df: pl.DataFrame) -> pl.DataFrame:
+    """
+    Create a mapping from display_id to both its game and its channel name.
+
+    Args:
+        videos_df (pl.DataFrame): DataFrame with 'display_id', 'video_game' and 'channel_id' columns.
+        channels_df (pl.DataFrame): DataFrame with 'channel_id' and 'channel_name' for channel name mapping.
+
+    Returns:
+        pl.DataFrame: A DataFrame with one row per 'display_id' and its 'game' and 'channel'.
+    """
+    return get_target_mapping(videos_df, channels_df, "game").join(
+        get_target_mapping(videos_df, channels_df, "channel"), on="display_id", how="left"
+    )
+
+
+def to_target_mapping_df(display_id_to_target, target_type: str) -> pl.DataFrame:
+    """
+    Convert a display_id to target mapping, given as a dictionary or as returned by get_target_mapping,
+    to a DataFrame with 'display_id' and target_type columns.
+
+    Args:
+        display_id_to_target (dict | pl.DataFrame): Mapping of display_id to target (game or channel name).
+        target_type (str): The target type, either 'game' or 'channel'.
+
+    Returns:
+        pl.DataFrame: The mapping as a DataFrame.
+    """
+    if isinstance(display_id_to_target, pl.DataFrame):
+        return display_id_to_target.select(["display_id", target_type])
+
+    return pl.DataFrame(
+        {
+            "display_id": list(display_id_to_target.keys()),
+            target_type: list(display_id_to_target.values()),
+        },
+        schema={"display_id": pl.String, target_type: pl.String},
+    )
 
 
 def filter_valid_comments(
@@ -57,61 +105,220 @@ def filter_valid_comments(
 
 
 def map_comments_to_target(
-    comments_df: pl.DataFrame, display_id_to_target: dict, target_type: str
+    comments_df: pl.DataFrame, display_id_to_target, target_type: str
 ) -> pl.DataFrame:
     """
     Map video_id in comments to the target (game or channel name).
 
     Args:
         comments_df (pl.DataFrame): DataFrame with 'author' and 'video_id' columns.
-        display_id_to_target (dict): Mapping of display_id to target (game or channel name).
+        display_id_to_target (pl.DataFrame | dict): Mapping of display_id to target (game or channel name),
+            as returned by get_target_mapping.
         target_type (str): The target type, either 'game' or 'channel'.
 
     Returns:
         pl.DataFrame: Comments DataFrame with the target column added.
     """
+    target_df = to_target_mapping_df(display_id_to_target, target_type)
 
-    def get_target(display_id: str):
-        return display_id_to_target.get(display_id, None)
-
-    return comments_df.with_columns(
-        pl.col("video_id").map_elements(get_target, return_dtype=str).alias(target_type)
+    return comments_df.join(
+        target_df, left_on="video_id", right_on="display_id", how="inner"
     ).drop_nulls(subset=[target_type]).drop("video_id")
 
 
-def compute_edges(comments_with_target: pl.DataFrame, target_type: str) -> list:
+def map_comments_to_targets(
+    comments_df: pl.DataFrame, display_id_to_targets: pl.DataFrame
+) -> pl.DataFrame:
+    """
+    Map video_id in comments to both its game and channel name in a single join.
+
+    Args:
+        comments_df (pl.DataFrame): DataFrame with 'author' and 'video_id' columns.
+        display_id_to_targets (pl.DataFrame): Mapping returned by get_targets_mapping.
+
+    Returns:
+        pl.DataFrame: Comments DataFrame with 'game' and 'channel' columns added, either of them being
+        null when the video has no such target.
+    """
+    return comments_df.join(
+        display_id_to_targets, left_on="video_id", right_on="display_id", how="inner"
+    ).drop("video_id")
+
+
+def compute_edge_weights(
+    comments_with_target: pl.DataFrame, target_type: str, block_size: int = None
+) -> pl.DataFrame:
+    """
+    Compute the number of distinct users who commented on each pair of targets (games or channels).
+
+    The comments are turned into a sparse author x target incidence matrix A, and the pair weights
+    are the upper triangle of the co-occurrence matrix A^T A. The comments do not need to be sorted.
+
+    Args:
+        comments_with_target (pl.DataFrame): DataFrame with 'author' and target column.
+        target_type (str): The target type, either 'game' or 'channel'.
+        block_size (int): If given, number of authors per block of A multiplied at once, to bound
+            the memory used by the product. Defaults to None (a single product).
+
+    Returns:
+        pl.DataFrame: A DataFrame with columns '{target_type}1' < '{target_type}2' and 'weight',
+        sorted by decreasing weight.
+    """
+    # Encode authors and targets, the target codes following the sorted target names
+    pairs_df = (
+        comments_with_target.select(["author", target_type])
+        .drop_nulls()
+        .unique()
+        .with_columns(
+            (pl.col("author").rank("dense") - 1).alias("author_code"),
+            (pl.col(target_type).rank("dense") - 1).alias("target_code"),
+        )
+    )
+    targets = pairs_df.get_column(target_type).unique().sort()
+    n_authors = pairs_df.get_column("author_code").max() + 1 if len(pairs_df) else 0
+
+    # Sparse author x target incidence matrix
+    incidence = sparse.csr_matrix(
+        (
+            np.ones(len(pairs_df), dtype=np.int64),
+            (pairs_df.get_column("author_code").to_numpy(), pairs_df.get_column("target_code").to_numpy()),
+        ),
+        shape=(n_authors, len(targets)),
+    )
+
+    # Co-occurrence matrix, accumulated over blocks of authors
+    block_size = block_size or max(n_authors, 1)
+    co_occurrences = sparse.csr_matrix((len(targets), len(targets)), dtype=np.int64)
+    for start in range(0, n_authors, block_size):
+        block = incidence[start : start + block_size]
+        co_occurrences = co_occurrences + block.T @ block
+
+    # Keep each pair once, with the first target sorting before the second
+    co_occurrences = sparse.triu(co_occurrences, k=1).tocoo()
+
+    return pl.DataFrame(
+        {
+            f"{target_type}1": targets.gather(co_occurrences.row),
+            f"{target_type}2": targets.gather(co_occurrences.col),
+            "weight": co_occurrences.data,
+        }
+    ).sort(
+        ["weight", f"{target_type}1", f"{target_type}2"],
+        descending=[True, False, False],
+    )
+
+
+def compute_edges(
+    comments_with_target: pl.DataFrame, target_type: str, block_size: int = None
+) -> list:
     """
     Compute edges based on shared users who comment on multiple targets (games or channels).
 
     Args:
         comments_with_target (pl.DataFrame): DataFrame with 'author' and target column.
         target_type (str): The target type, either 'game' or 'channel'.
+        block_size (int): If given, number of authors per block (see compute_edge_weights).
 
     Returns:
         list: Sorted list of edges with their weights.
     """
-    rows = comments_with_target.shape[0]
-    curr_author = None
-    targets = set()
-    edges = {}
-    authors = 0
-
-    # Select only 'author' and the target column
-    comments_iter = comments_with_target.iter_rows()
-
-    for author, target in comments_iter:
-        if author != curr_author:
-            curr_author = author
-            if len(targets) > 1:
-                for edge in combinations(targets, 2):
-                    edge = tuple(sorted(edge))
-                    edges[edge] = edges.get(edge, 0) + 1
-            targets = set()
-            authors += 1
-
-        targets.add(target)
-
-    return sorted(edges.items(), key=lambda x: x[1], reverse=True)
+    edges_df = compute_edge_weights(comments_with_target, target_type, block_size)
+
+    return list(
+        zip(
+            zip(edges_df.get_column(f"{target_type}1"), edges_df.get_column(f"{target_type}2")),
+            edges_df.get_column("weight"),
+        )
+    )
+
+
+def compute_edge_weights_out_of_core(
+    comments_path: str,
+    display_id_to_target: dict,
+    target_type: str,
+    shard_dir: str,
+    memory_budget: int = 2_000_000_000,
+    separator: str = "\t",
+) -> pl.DataFrame:
+    """
+    Compute the same edge weights as compute_edge_weights directly from the comments file, without
+    loading it in memory.
+
+    The comments are read in batches, mapped to their target and hash-partitioned by author into
+    on-disk shards in a single scan. Since all the comments of an author land in the same shard, the
+    pair counts of each shard can be computed independently and summed into the final edge table.
+
+    Args:
+        comments_path (str): Path to the comments file, with 'author' and 'video_id' columns.
+        display_id_to_target (pl.DataFrame | dict): Mapping of display_id to target (game or channel name),
+            as returned by get_target_mapping.
+        target_type (str): The target type, either 'game' or 'channel'.
+        shard_dir (str): Directory where the shards are written, replacing the shards of a previous run.
+        memory_budget (int): Approximate memory budget in bytes, which sets the size of the
+            batches read and the number of shards. Defaults to 2GB.
+        separator (str): Separator of the comments file. Defaults to tab.
+
+    Returns:
+        pl.DataFrame: A DataFrame with columns '{target_type}1' < '{target_type}2' and 'weight',
+        sorted by decreasing weight.
+    """
+    target_df = to_target_mapping_df(display_id_to_target, target_type).rename(
+        {"display_id": "video_id"}
+    )
+
+    # Each shard should fit in the budget, each batch takes a fraction of it
+    n_shards = max(1, int(np.ceil(os.path.getsize(comments_path) / memory_budget)))
+    batch_size = max(1, memory_budget // (4 * BYTES_PER_COMMENT))
+
+    # Remove the shards of a previous run
+    for shard_path in glob.glob(os.path.join(shard_dir, "shard=*")):
+        shutil.rmtree(shard_path)
+
+    # Scan the comments once and hash-partition them by author
+    reader = pl.read_csv_batched(
+        comments_path,
+        separator=separator,
+        columns=["author", "video_id"],
+        schema_overrides={"video_id": pl.String},
+        batch_size=batch_size,
+    )
+    n_batches = 0
+    with tqdm(desc="Sharding comments", unit=" comments") as progress_bar:
+        while batches := reader.next_batches(1):
+            batch_df = batches[0]
+            progress_bar.update(len(batch_df))
+
+            shards = (
+                batch_df.join(target_df, on="video_id", how="inner")
+                .select(["author", target_type])
+                .unique()
+                .with_columns((pl.col("author").hash() % n_shards).alias("shard"))
+                .partition_by("shard", as_dict=True, include_key=False)
+            )
+            for (shard,), shard_df in shards.items():
+                shard_path = os.path.join(shard_dir, f"shard={shard}")
+                os.makedirs(shard_path, exist_ok=True)
+                shard_df.write_parquet(os.path.join(shard_path, f"part-{n_batches}.parquet"))
+            n_batches += 1
+
+    # Count the pairs of each shard and fold them into the running total, which is at most the final edge table
+    edges_df = compute_edge_weights(
+        pl.DataFrame(schema={"author": pl.Int64, target_type: pl.String}), target_type
+    )
+    for shard in tqdm(range(n_shards), desc="Counting pairs per shard"):
+        shard_path = os.path.join(shard_dir, f"shard={shard}")
+        if os.path.isdir(shard_path):
+            shard_df = pl.read_parquet(os.path.join(shard_path, "*.parquet"))
+            edges_df = (
+                pl.concat([edges_df, compute_edge_weights(shard_df, target_type)], how="vertical_relaxed")
+                .group_by([f"{target_type}1", f"{target_type}2"])
+                .agg(pl.col("weight").sum())
+            )
+
+    return edges_df.sort(
+        ["weight", f"{target_type}1", f"{target_type}2"],
+        descending=[True, False, False],
+    )
 
 
 def create_edges_df(sorted_edges: list, target_type: str) -> pl.DataFrame:
@@ -0,0 +1,325 @@
+"""Esports tournaments index, joined against the games timeseries rollup."""
+
+import polars as pl
+from scipy import stats
+
+from src.timeseries import ROLLUP_PERIODS
+
+# Format of the dates in esports_tournaments.csv
+TOURNAMENT_DATE_FORMAT = "%m/%d/%y"
+
+# Metrics compared around the tournaments
+EVENT_METRICS = ["delta_views", "delta_subs", "delta_videos"]
+
+# Patterns on the tournament names and the video game they map to, the first matching pattern wins
+TOURNAMENT_GAMES = [
+    (r"cs:go|eleague|esl pro league|esports championship series|\biem\b|intel grand slam|faceit major|pgl major|starladder|mlg major|blast premier|esl one: cologne|flashpoint", "counterstrike global offensive"),
+    (r"dota ?2|the international|\bdac\b|dreamleague|epicenter|\bmdl\b|supermajor|the [\w ]+ major|esl one", "dota 2"),
+    (r"\blol\b|\blpl\b|mid-season (invitational|cup)", "league of legends"),
+    (r"fortnite|fncs|winter royale", "fortnite"),
+    (r"call of duty|\bcwl\b", "call of duty"),
+    (r"overwatch", "overwatch"),
+    (r"\bhgc\b", "heroes of the storm"),
+    (r"hearthstone", "hearthstone"),
+    (r"\bwcs\b", "starcraft ii"),
+    (r"halo", "halo 5 guardians"),
+    (r"smite", "smite"),
+    (r"six invitational", "tom clancys rainbow six siege"),
+    (r"rlcs", "rocket league"),
+    (r"pubg mobile|peacekeeper", "pubg mobile"),
+    (r"pubg|pgi\.s", "playerunknowns battlegrounds"),
+    (r"clash of clans", "clash of clans"),
+    (r"king pro league|honor of kings", "honor of kings"),
+    (r"\baov\b", "arena of valor"),
+    (r"mythic|magic world championship", "magic the gathering arena"),
+    (r"crossfire", "crossfire"),
+    (r"shadowverse", "shadowverse"),
+    (r"quake", "quake champions"),
+    (r"auto chess", "auto chess"),
+]
+
+
+def load_esports_tournaments(
+    path: str, patterns: list[tuple[str, str]] = TOURNAMENT_GAMES
+) -> pl.DataFrame:
+    """
+    Load the esports tournaments and map each of them to a video game from its name.
+
+    Args:
+        path (str): Path to esports_tournaments.csv.
+        patterns (list[tuple[str, str]]): Case-insensitive patterns on the tournament names and their video game,
+            the first matching pattern wins. Defaults to TOURNAMENT_GAMES.
+
+    Returns:
+        pl.DataFrame: The tournaments with columns 'tournament_id', 'tournament', 'video_game' (null if no pattern
+        matches), 'start_date', 'end_date' and 'prize', sorted by start date.
+    """
+    return (
+        pl.read_csv(path)
+        .select(
+            pl.col("GameID").alias("tournament_id"),
+            pl.col("TournamentName").alias("tournament"),
+            pl.coalesce(
+                pl.when(pl.col("TournamentName").str.contains(f"(?i){pattern}")).then(pl.lit(video_game))
+                for pattern, video_game in patterns
+            ).alias("video_game"),
+            pl.col("StartDate").str.to_date(TOURNAMENT_DATE_FORMAT).alias("start_date"),
+            pl.col("EndDate").str.to_date(TOURNAMENT_DATE_FORMAT).alias("end_date"),
+            pl.col("TotalUSDPrize").cast(pl.Float64).alias("prize"),
+        )
+        .sort("start_date", maintain_order=True)
+    )
+
+
+def event_dates(tournaments_df: pl.DataFrame, video_game: str) -> list[tuple[str, str]]:
+    """
+    List the start dates of the tournaments of a game, in the format of the events of plot_metric and metric_to_json.
+
+    Args:
+        tournaments_df (pl.DataFrame): The tournaments returned by load_esports_tournaments.
+        video_game (str): The name of the game.
+
+    Returns:
+        list[tuple[str, str]]: The name and start date of each tournament.
+    """
+    return (
+        tournaments_df.filter(pl.col("video_game") == video_game)
+        .select("tournament", pl.col("start_date").dt.strftime("%Y-%m-%d"))
+        .rows()
+    )
+
+
+def overlapping_tournaments(
+    periods_df: pl.DataFrame,
+    tournaments_df: pl.DataFrame,
+    every: str = "1w",
+    game_column: str = "top_game",
+) -> pl.DataFrame:
+    """
+    Find the tournaments of the same game overlapping each period, such as the periods of the games rollup.
+
+    Args:
+        periods_df (pl.DataFrame): DataFrame with a 'period' start column and a game column.
+        tournaments_df (pl.DataFrame): The tournaments returned by load_esports_tournaments.
+        every (str): Length of the periods, as a Polars duration. Default is '1w' (weekly).
+        game_column (str): Name of the game column of the periods. Default is 'top_game'.
+
+    Returns:
+        pl.DataFrame: One row per overlapping period and tournament, with the columns of both.
+    """
+    return (
+        periods_df.lazy()
+        .join(
+            tournaments_df.lazy().filter(pl.col("video_game").is_not_null()),
+            left_on=game_column,
+            right_on="video_game",
+            how="inner",
+        )
+        .filter(
+            (pl.col("start_date").cast(pl.Datetime) < pl.col("period").dt.offset_by(every))
+            & (pl.col("end_date").cast(pl.Datetime) >= pl.col("period"))
+        )
+        .collect()
+    )
+
+
+def event_windows(
+    tournaments_df: pl.DataFrame,
+    rollup_df: pl.DataFrame,
+    period: str = "W",
+    n_periods: int = 4,
+    metrics: list[str] = None,
+) -> pl.DataFrame:
+    """
+    Slice the periods before, during and after every tournament from the games rollup. The tournament start
+    and end are located with as-of joins on the periods of their game, so that the windows are counted in
+    periods with data. Tournaments starting or ending outside the periods of their game, after its last
+    period or within a gap of its data, are left out.
+
+    Args:
+        tournaments_df (pl.DataFrame): The tournaments returned by load_esports_tournaments.
+        rollup_df (pl.DataFrame): The rollup returned by build_games_rollup.
+        period (str): The granularity of the rollup to use, one of 'D', 'W' or 'M'. Default is 'W' (weekly).
+        n_periods (int): Number of periods of the windows before and after the tournaments. Default is 4.
+        metrics (list[str]): The metrics to return. Defaults to EVENT_METRICS.
+
+    Returns:
+        pl.DataFrame: One row per tournament and period of its windows, with columns 'tournament_id',
+        'video_game', 'window' ('pre', 'during' or 'post'), 'offset' (in periods from the start for 'pre' and
+        'during', and from the end for 'post'), 'period' and the metrics.
+    """
+    metrics = metrics or EVENT_METRICS
+    periods_df = (
+        rollup_df.filter(pl.col("granularity") == period)
+        .select(pl.col("top_game").alias("video_game"), "period", *metrics)
+        .sort("video_game", "period")
+        .with_columns(pl.int_range(pl.len()).over("video_game").alias("index"))
+        .sort("period")
+    )
+
+    # Index of the periods containing the start and the end of each tournament
+    bounds_df = tournaments_df.filter(pl.col("video_game").is_not_null()).select(
+        "tournament_id",
+        "video_game",
+        pl.col("start_date").cast(pl.Datetime(periods_df.schema["period"].time_unit)),
+        pl.col("end_date").cast(pl.Datetime(periods_df.schema["period"].time_unit)),
+    )
+    for bound in ["start", "end"]:
+        bounds_df = bounds_df.sort(f"{bound}_date").join_asof(
+            periods_df.select("video_game", "period", pl.col("index").alias(f"{bound}_index")),
+            left_on=f"{bound}_date",
+            right_on="period",
+            by="video_game",
+            strategy="backward",
+        ).with_columns(
+            # Only keep the period if it contains the date
+            pl.when(pl.col(f"{bound}_date") < pl.col("period").dt.offset_by(ROLLUP_PERIODS[period]))
+            .then(pl.col(f"{bound}_index"))
+            .alias(f"{bound}_index")
+        ).drop("period")
+
+    # Periods of the game within the windows of each tournament
+    return (
+        bounds_df.filter(pl.col("start_index").is_not_null() & pl.col("end_index").is_not_null())
+        .with_columns(
+            pl.int_ranges(
+                (pl.col("start_index") - n_periods).clip(lower_bound=0), pl.col("end_index") + n_periods + 1
+            ).alias("index")
+        )
+        .explode("index")
+        .join(periods_df, on=["video_game", "index"], how="inner")
+        .select(
+            "tournament_id",
+            "video_game",
+            pl.when(pl.col("index") < pl.col("start_index")).then(pl.lit("pre"))
+            .when(pl.col("index") > pl.col("end_index")).then(pl.lit("post"))
+            .otherwise(pl.lit("during"))
+            .alias("window"),
+            pl.when(pl.col("index") > pl.col("end_index"))
+            .then(pl.col("index") - pl.col("end_index"))
+            .otherwise(pl.col("index") - pl.col("start_index"))
+            .alias("offset"),
+            "period",
+            *metrics,
+        )
+        .sort("tournament_id", "period")
+    )
+
+
+def event_window_metrics(
+    tournaments_df: pl.DataFrame,
+    rollup_df: pl.DataFrame,
+    period: str = "W",
+    n_periods: int = 4,
+    metrics: list[str] = None,
+) -> pl.DataFrame:
+    """
+    Compute the mean of the metrics before, during and after every tournament.
+
+    Args:
+        tournaments_df (pl.DataFrame): The tournaments returned by load_esports_tournaments.
+        rollup_df (pl.DataFrame): The rollup returned by build_games_rollup.
+        period (str): The granularity of the rollup to use, one of 'D', 'W' or 'M'. Default is 'W' (weekly).
+        n_periods (int): Number of periods of the windows before and after the tournaments. Default is 4.
+        metrics (list[str]): The metrics to average. Defaults to EVENT_METRICS.
+
+    Returns:
+        pl.DataFrame: The tournaments with a '{metric}_{window}' column per metric and window.
+    """
+    metrics = metrics or EVENT_METRICS
+    windows_df = event_windows(tournaments_df, rollup_df, period, n_periods, metrics)
+    window_means_df = windows_df.group_by("tournament_id").agg(
+        pl.col(metric).filter(pl.col("window") == window).mean().alias(f"{metric}_{window}")
+        for metric in metrics
+        for window in ["pre", "during", "post"]
+    )
+    return tournaments_df.join(window_means_df, on="tournament_id", how="inner")
+
+
+def events_from_dates(dates: dict[str, list[tuple[str, str]]]) -> pl.DataFrame:
+    """
+    Build an events table, with the columns of the tournaments, from hand-picked events such as those of plot_metric.
+
+    Args:
+        dates (dict[str, list[tuple[str, str]]]): Dictionary with game names as keys and event tuples (event_name, date) as values.
+
+    Returns:
+        pl.DataFrame: The events, lasting one day each.
+    """
+    return pl.DataFrame(
+        [
+            (video_game, event_name, date)
+            for video_game, events in dates.items()
+            for event_name, date in events
+        ],
+        schema={"video_game": pl.String, "tournament": pl.String, "start_date": pl.String},
+        orient="row",
+    ).select(
+        pl.int_range(pl.len()).alias("tournament_id"),
+        "tournament",
+        "video_game",
+        pl.col("start_date").str.to_date("%Y-%m-%d"),
+        pl.col("start_date").str.to_date("%Y-%m-%d").alias("end_date"),
+    )
+
+
+def event_impact(
+    events_df: pl.DataFrame,
+    rollup_df: pl.DataFrame,
+    metric: str = "delta_views",
+    period: str = "W",
+    n_periods: int = 4,
+) -> pl.DataFrame:
+    """
+    Measure the impact of every event on a metric of its game, comparing the windows before and after it.
+    The significance is estimated with a Welch t-test between the periods of the two windows. Events
+    without any period with data before or after them are left out.
+
+    Args:
+        events_df (pl.DataFrame): The tournaments returned by load_esports_tournaments, or the events returned by events_from_dates.
+        rollup_df (pl.DataFrame): The rollup returned by build_games_rollup.
+        metric (str): The metric to compare. Default is 'delta_views'.
+        period (str): The granularity of the rollup to use, one of 'D', 'W' or 'M'. Default is 'W' (weekly).
+        n_periods (int): Number of periods of the windows before and after the events. Default is 4.
+
+    Returns:
+        pl.DataFrame: The events with the mean of the metric before and after them, the 'delta' between the two,
+        the relative 'lift', and the 't_stat' and two-sided 'p_value' of the difference.
+    """
+    windows_df = event_windows(events_df, rollup_df, period, n_periods, [metric])
+
+    # Size, mean and variance of the windows before and after each event
+    impact_df = windows_df.group_by("tournament_id").agg(
+        statistic(pl.col(metric).filter(pl.col("window") == window)).alias(f"{name}_{window}")
+        for window in ["pre", "post"]
+        for name, statistic in [("n", pl.Expr.count), ("mean", pl.Expr.mean), ("var", pl.Expr.var)]
+    ).filter((pl.col("n_pre") > 0) & (pl.col("n_post") > 0))
+
+    # Welch t-statistic and Welch-Satterthwaite degrees of freedom
+    impact_df = impact_df.with_columns(
+        (pl.col("mean_post") - pl.col("mean_pre")).alias("delta"),
+        ((pl.col("mean_post") - pl.col("mean_pre")) / pl.col("mean_pre").abs()).alias("lift"),
+        (pl.col("var_pre") / pl.col("n_pre")).alias("se2_pre"),
+        (pl.col("var_post") / pl.col("n_post")).alias("se2_post"),
+    ).with_columns(
+        (pl.col("delta") / (pl.col("se2_pre") + pl.col("se2_post")).sqrt()).alias("t_stat"),
+        (
+            (pl.col("se2_pre") + pl.col("se2_post")) ** 2
+            / (pl.col("se2_pre") ** 2 / (pl.col("n_pre") - 1) + pl.col("se2_post") ** 2 / (pl.col("n_post") - 1))
+        ).alias("dof"),
+    )
+    p_values = 2 * stats.t.sf(
+        impact_df.get_column("t_stat").abs().to_numpy(), impact_df.get_column("dof").to_numpy()
+    )
+
+    return (
+        events_df.join(
+            impact_df.with_columns(pl.Series("p_value", p_values, nan_to_null=True)),
+            on="tournament_id",
+            how="inner",
+        )
+        .select(
+            pl.exclude("se2_pre", "se2_post", "var_pre", "var_post", "dof"),
+        )
+        .sort("start_date", "tournament_id")
+    )
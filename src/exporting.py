@@ -2,7 +2,7 @@ import pandas as pd
 import polars as pl
 import numpy as np
 import json
-from src.timeseries import generate_metric_for_channels, generate_views_for_game
+from src.timeseries import ROLLUP_PERIODS
 
 def export_all(
     pie_chart_data_df,
@@ -331,12 +331,237 @@ def export_network_json(G, positions, popularity, partition, output_path):
 
 """-------------------------------------Time Series ------------------------------------- """
 
+def compute_period_sums(
+    df: pl.DataFrame,
+    game_names: list[str],
+    channel_views: bool = True,
+    period: str = "W",
+    metric: str = "views",
+) -> pd.Series:
+    """
+    Aggregate a metric by period for several games at once.
+
+    Args:
+        df (pl.DataFrame): The games timeseries or rollup if channel_views, else the videos with 'upload_date',
+            'view_count' and 'video_game' columns.
+        game_names (list[str]): List of game names to aggregate.
+        channel_views (bool): Whether to aggregate the channels timeseries. Default is True.
+        period (str): Grouping period for time series. Default is 'W' (weekly).
+        metric (str): The channels metric to aggregate. Default is 'views'.
+
+    Returns:
+        pd.Series: The metric indexed by game and period. As in generate_metric_for_channels, the channels
+        periods are only those with data and labelled by their start, and as in generate_views_for_game,
+        the videos periods are resampled and labelled by their end.
+    """
+    if not channel_views:
+        game_df = df.filter(pl.col("video_game").is_in(game_names)).to_pandas()
+        if not pd.api.types.is_datetime64_any_dtype(game_df["upload_date"]):
+            game_df["upload_date"] = pd.to_datetime(game_df["upload_date"])
+        return (
+            game_df.set_index("upload_date")
+            .groupby("video_game")["view_count"]
+            .resample(period)
+            .sum()
+            .rename_axis(["game", "period"])
+        )
+
+    column_name = f"delta_{metric}" if metric in ("views", "subs") else "delta_videos"
+    if "granularity" in df.columns and period in ROLLUP_PERIODS:
+        # Slice the pre-aggregated periods
+        game_df = (
+            df.filter((pl.col("granularity") == period) & pl.col("top_game").is_in(game_names))
+            .select(["top_game", "period", column_name])
+            .to_pandas()
+        )
+        game_df["period"] = pd.to_datetime(game_df["period"])
+        return game_df.set_index(["top_game", "period"])[column_name].sort_index().rename_axis(["game", "period"])
+
+    game_df = df.filter(pl.col("top_game").is_in(game_names)).to_pandas()
+    game_df["period"] = pd.to_datetime(game_df["datetime"]).dt.to_period(period)
+    period_sums = game_df.groupby(["top_game", "period"])[column_name].sum()
+    period_sums.index = period_sums.index.set_levels(period_sums.index.levels[1].to_timestamp(), level=1)
+    return period_sums.rename_axis(["game", "period"])
+
+
+def compute_game_metrics(
+    period_sums: pd.Series,
+    game_names: list[str],
+    channel_views: bool = True,
+    period: str = "W",
+    window: int = 4,
+    lower_cutoff: str = None,
+) -> pd.DataFrame:
+    """
+    Compute the rolling average of the period sums of several games on a shared period grid.
+
+    Args:
+        period_sums (pd.Series): The period sums returned by compute_period_sums.
+        game_names (list[str]): List of game names, in the order of the columns.
+        channel_views (bool): Whether the period sums are from the channels timeseries. Default is True.
+        period (str): Grouping period for time series. Default is 'W' (weekly).
+        window (int): Rolling average window size. Default is 4.
+        lower_cutoff (str): The lower cutoff date for the data. Default is None.
+
+    Returns:
+        pd.DataFrame: One column per game indexed by period, with zeros outside of the periods of each game.
+    """
+    period_sums = period_sums[period_sums.index.get_level_values("game").isin(game_names)]
+    periods = period_sums.index.get_level_values("period")
+
+    if channel_views:
+        # The channels cutoff is applied before the rolling average, without partial windows
+        if lower_cutoff:
+            period_sums = period_sums[periods >= pd.Timestamp(lower_cutoff)]
+        rolling = period_sums.groupby(level="game").rolling(window=window).mean()
+    else:
+        # The videos cutoff is applied after the rolling average, with partial windows
+        rolling = period_sums.groupby(level="game").rolling(window=window, min_periods=1).mean()
+        if lower_cutoff:
+            rolling = rolling[rolling.index.get_level_values(-1) >= pd.Timestamp(lower_cutoff)]
+    rolling.index = rolling.index.droplevel(0)
+
+    metrics = rolling.unstack(level="game").fillna(0)
+    if channel_views:
+        grid = pd.period_range(metrics.index.min(), metrics.index.max(), freq=period).to_timestamp()
+    else:
+        grid = pd.date_range(metrics.index.min(), metrics.index.max(), freq=period)
+    return metrics.reindex(index=grid, columns=game_names, fill_value=0)
+
+
+def snap_events(axis: pd.DatetimeIndex, dates: list[tuple[str, str]]) -> list:
+    """
+    Snap the one week window around each event to the closest dates of a sorted axis.
+
+    Args:
+        axis (pd.DatetimeIndex): The sorted dates of the x axis.
+        dates (list[tuple[str, str]]): A list of tuples containing the event name and date.
+
+    Returns:
+        list: The markArea data, a pair of start and end points per event.
+    """
+    event_dates = pd.to_datetime([date for _, date in dates])
+    labels = axis.strftime("%Y-%m-%d")
+
+    def closest(targets):
+        # Index of the first date after each target, then the closest of it and its predecessor, the earliest on ties
+        after = np.clip(np.searchsorted(axis.values, targets.values), 1, len(axis) - 1)
+        before = after - 1
+        pick_after = (axis.values[after] - targets.values) < (targets.values - axis.values[before])
+        return np.where(pick_after, after, before)
+
+    starts = closest(event_dates - pd.Timedelta(weeks=1))
+    ends = closest(event_dates + pd.Timedelta(weeks=1))
+    return [
+        [
+            {"name": f"{event_name} Start", "xAxis": labels[start]},
+            {"name": f"{event_name} End", "xAxis": labels[end]},
+        ]
+        for (event_name, _), start, end in zip(dates, starts, ends)
+    ]
+
+
+def lttb_indices(y: np.ndarray, n_points: int) -> np.ndarray:
+    """
+    Select the points of a series to keep with the Largest-Triangle-Three-Buckets algorithm, which preserves
+    the visual shape of the series: the first and last points are kept, and from each bucket of the points in
+    between, the one forming the largest triangle with the point kept from the previous bucket and the mean
+    of the next bucket.
+
+    Args:
+        y (np.ndarray): The values of the series, at evenly spaced positions.
+        n_points (int): Number of points to keep, at least 3.
+
+    Returns:
+        np.ndarray: The sorted indices of the points to keep.
+    """
+    n = len(y)
+    if n_points >= n:
+        return np.arange(n)
+
+    x = np.arange(n, dtype=np.float64)
+    edges = np.linspace(1, n - 1, n_points - 1).astype(int)
+    indices = np.empty(n_points, dtype=int)
+    indices[0], indices[-1] = 0, n - 1
+
+    for i in range(n_points - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < n_points - 1 else n
+        next_x, next_y = x[end:next_end].mean(), y[end:next_end].mean()
+        previous = indices[i]
+        # Twice the area of the triangles with the previous point and the mean of the next bucket
+        areas = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        indices[i + 1] = start + areas.argmax()
+
+    return indices
+
+
+def downsample_metrics(metrics: pd.DataFrame, n_points: int) -> pd.DataFrame:
+    """
+    Downsample the series of a chart on a shared axis, running LTTB on the sum of the series scaled to [0, 1]
+    so that the peaks of every series are kept.
+
+    Args:
+        metrics (pd.DataFrame): One column per series on a shared index, as returned by compute_game_metrics.
+        n_points (int): Number of points to keep, at least 3.
+
+    Returns:
+        pd.DataFrame: The rows of the metrics to keep.
+    """
+    if len(metrics) <= n_points:
+        return metrics
+    values = metrics.to_numpy(dtype=np.float64)
+    ranges = values.max(axis=0) - values.min(axis=0)
+    scaled = (values - values.min(axis=0)) / np.where(ranges > 0, ranges, 1)
+    return metrics.iloc[lttb_indices(scaled.sum(axis=1), n_points)]
+
+
+def write_chart_json(
+    build_chart, metrics: pd.DataFrame, output_file: str, max_points: int = None, max_bytes: int = None
+) -> None:
+    """
+    Write a chart to a JSON file, optionally downsampling its series and writing it compactly to fit a size budget.
+
+    Args:
+        build_chart (callable): Function building the JSON structure of the chart from its metrics.
+        metrics (pd.DataFrame): One column per series on a shared index, as returned by compute_game_metrics.
+        output_file (str): Output JSON file path.
+        max_points (int): Maximum number of points per series. Defaults to None, keeping all of them.
+        max_bytes (int): Maximum size of the file, the number of points being reduced until it fits. Defaults to None.
+    """
+    if max_points is None and max_bytes is None:
+        with open(output_file, "w") as f:
+            json.dump(build_chart(metrics), f, indent=4)
+        return
+
+    n_points = max(3, min(len(metrics), max_points or len(metrics)))
+    while True:
+        chart_json = json.dumps(
+            build_chart(downsample_metrics(metrics, n_points).round(2)), separators=(",", ":")
+        )
+        size = len(chart_json.encode())
+        if max_bytes is None or size <= max_bytes or n_points == 3:
+            break
+        # Scale the number of points to the budget, with a margin for the fixed part of the chart
+        n_points = max(3, min(n_points - 1, int(n_points * max_bytes / size * 0.95)))
+
+    if max_bytes is not None and size > max_bytes:
+        print(f"{output_file} is {size} bytes, over its budget of {max_bytes} bytes")
+    with open(output_file, "w") as f:
+        f.write(chart_json)
+
+
 def export_views_top_games_json(
     df: pl.DataFrame,
     game_names: str,
     period: str = "W",
     window: int = 3,
     output_file="weekly_delta_views.json",
+    max_points: int = None,
+    max_bytes: int = None,
 ):
     """
     Exports a JSON file containing delta_views for each week for a list of games and the corresponding time axis.
@@ -347,25 +572,86 @@ def export_views_top_games_json(
         period (str): Grouping period for time series. Default is 'W' (weekly).
         window (int): Rolling average window size. Default is 3.
         output_file (str): Name of the JSON file to export.
+        max_points (int): Maximum number of weeks, downsampled with LTTB. Defaults to None, keeping all of them.
+        max_bytes (int): Maximum size of the file. Defaults to None.
 
     Returns:
         None
     """
-    result = {"weeks": None}  
-    # Loop through each game and collect delta_views
-    for game_name in game_names:
-        metric = generate_views_for_game(
-            df=df,
-            game_name=game_name,
-            period=period,
-            window=window,
-            
-        )
-        result[game_name] = metric["view_count"].astype(int).tolist()
-        result["weeks"] = metric.index.astype(str).tolist()
+    period_sums = compute_period_sums(df, game_names, channel_views=False, period=period)
+    metrics = compute_game_metrics(period_sums, game_names, channel_views=False, period=period, window=window)
+
+    def build_chart(metrics):
+        result = {"weeks": metrics.index.astype(str).tolist()}
+        for game_name in game_names:
+            result[game_name] = metrics[game_name].astype(int).tolist()
+        return result
+
     # Export to JSON
-    with open(output_file, "w") as f:
-        json.dump(result, f, indent=4)
+    write_chart_json(build_chart, metrics, output_file, max_points, max_bytes)
+
+
+def metrics_to_json(
+    df: pl.DataFrame,
+    charts: list[dict],
+    channel_views: bool = True,
+    period: str = "W",
+    metric: str = "views",
+    max_points: int = None,
+    max_bytes: int = None,
+) -> None:
+    """
+    Export several game metric charts at once, aggregating the games of all the charts in a single pass.
+
+    Args:
+        df (pl.DataFrame): DataFrame containing game time series data.
+        charts (list[dict]): One dictionary per chart with the 'game_names' and 'output_file' of the chart, and
+            optionally its event 'dates', rolling average 'window' (default 4) and 'lower_cutoff'.
+        channel_views (bool): Whether to generate metrics for individual channels. Default is True.
+        period (str): Grouping period for time series. Default is 'W' (weekly).
+        metric (str): The metric to plot. Default is 'views'.
+        max_points (int): Maximum number of points per series, downsampled with LTTB on a shared axis, the events
+            being placed on the downsampled axis. Defaults to None, keeping all of them.
+        max_bytes (int): Maximum size of each file. Defaults to None.
+    """
+    all_game_names = list(dict.fromkeys(name for chart in charts for name in chart["game_names"]))
+    period_sums = compute_period_sums(df, all_game_names, channel_views, period, metric)
+
+    for chart in charts:
+        game_names = chart["game_names"]
+        metrics = compute_game_metrics(
+            period_sums,
+            game_names,
+            channel_views,
+            period,
+            chart.get("window", 4),
+            chart.get("lower_cutoff"),
+        )
+
+        def build_chart(metrics, game_names=game_names, dates=chart.get("dates")):
+            # Add markArea data if event dates are provided
+            mark_area_data = {}
+            if dates:
+                mark_area_data["data"] = snap_events(metrics.index, dates)
+            mark_area_data["itemStyle"] = {"color": "rgba(255, 173, 177, 0.4)"}
+
+            # Prepare the final JSON structure
+            return {
+                "title": {"text": f"{metric.capitalize()} Over Time of {', '.join([name.title() for name in game_names])}"},
+                "xAxis": {"data": metrics.index.strftime("%Y-%m-%d").tolist()},
+                "series": [
+                    {
+                        "name": game_name,
+                        "type": "line",
+                        "data": metrics[game_name].tolist(),
+                        "markArea": mark_area_data,
+                    }
+                    for game_name in game_names
+                ],
+            }
+
+        # Write to the output file
+        write_chart_json(build_chart, metrics, "../website/data/" + chart["output_file"], max_points, max_bytes)
 
 
 def metric_to_json(
@@ -378,6 +664,8 @@ def metric_to_json(
     metric: str = "views",
     output_file: str = "games_metrics.json",
     lower_cutoff: str = None,
+    max_points: int = None,
+    max_bytes: int = None,
 ) -> None:
     """
     Export game metric data and event dates into a JSON format compatible with charting libraries.
@@ -392,93 +680,23 @@ def metric_to_json(
         metric (str): The metric to plot. Default is 'views'.
         output_file (str): Output JSON file path. Default is 'games_metrics.json'.
         lower_cutoff (str): The lower cutoff date for the data. Default is None.
+        max_points (int): Maximum number of points per series, downsampled with LTTB. Defaults to None, keeping all of them.
+        max_bytes (int): Maximum size of the file. Defaults to None.
     """
-    series_data = []
-    all_x_axis_data = []
-
-    for game_name in game_names:
-        if channel_views:
-            views = generate_metric_for_channels(
-                games_timeseries_df=df,
-                game_name=game_name,
-                period=period,
-                window=window,
-                metric=metric,
-                lower_cutoff=lower_cutoff
-            )
-            x_axis_data = views["period"].dt.strftime("%Y-%m-%d").tolist()
-        else:
-            views = generate_views_for_game(df, game_name, period, window, lower_cutoff)
-            x_axis_data = views.index.strftime("%Y-%m-%d").tolist()
-
-        all_x_axis_data.append(x_axis_data)
-        y_axis_data = views["view_count"].fillna(0).tolist()
-
-        # Save the series data temporarily
-        series_data.append((game_name, x_axis_data, y_axis_data))
-
-    # Find the earliest start date
-    earliest_date = min(min(pd.to_datetime(axis)) for axis in all_x_axis_data)
-
-    # Calculate offsets and adjust data
-    final_x_axis = pd.date_range(
-        start=earliest_date,
-        end=max(max(pd.to_datetime(axis)) for axis in all_x_axis_data),
-        freq=period,
-    ).strftime("%Y-%m-%d").tolist()
-
-    aligned_series_data = []
-    for game_name, x_axis_data, y_axis_data in series_data:
-        offset = (pd.to_datetime(x_axis_data[0]) - earliest_date).days // 7  # Offset in weeks
-        aligned_y_axis = [0] * offset + y_axis_data
-        aligned_y_axis += [0] * (len(final_x_axis) - len(aligned_y_axis))
-        aligned_series_data.append(
+    metrics_to_json(
+        df,
+        [
             {
-                "name": game_name,
-                "type": "line",
-                "data": aligned_y_axis,
+                "game_names": game_names,
+                "dates": dates,
+                "window": window,
+                "lower_cutoff": lower_cutoff,
+                "output_file": output_file,
             }
-        )
-
-    # Add markArea data if event dates are provided
-    mark_area_data = {}
-    if dates:
-        data = []
-        for event_name, date in dates:
-            event_date = pd.to_datetime(date)
-            start_date = min(
-                final_x_axis,
-                key=lambda d: abs(
-                    pd.Timestamp(d) - (event_date - pd.Timedelta(weeks=1))
-                ),
-            )
-            end_date = min(
-                final_x_axis,
-                key=lambda d: abs(
-                    pd.Timestamp(d) - (event_date + pd.Timedelta(weeks=1))
-                ),
-            )
-            data.append(
-                [
-                    {"name": f"{event_name} Start", "xAxis": start_date},
-                    {"name": f"{event_name} End", "xAxis": end_date},
-                ]
-            )
-        mark_area_data["data"] = data
-
-    mark_area_data["itemStyle"] = {"color": "rgba(255, 173, 177, 0.4)"}
-
-    # Assign the markArea data to each series
-    for series in aligned_series_data:
-        series["markArea"] = mark_area_data
-
-    # Prepare the final JSON structure
-    chart_json = {
-        "title": {"text": f"{metric.capitalize()} Over Time of {', '.join([name.title() for name in game_names])}"},
-        "xAxis": {"data": final_x_axis},
-        "series": aligned_series_data,
-    }
-
-    # Write to the output file
-    with open("../website/data/" + output_file, "w") as f:
-        json.dump(chart_json, f, indent=4)
+        ],
+        channel_views,
+        period,
+        metric,
+        max_points,
+        max_bytes,
+    )
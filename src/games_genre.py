@@ -2,20 +2,22 @@ import polars as pl
 import pandas as pd
 import numpy as np
 
+from src.utils import to_date
+
 
 def join_games_with_genres(games_df, with_game_df):
     """
     Converts games_df to a Polars DataFrame, lowercases the 'Title' column, and joins it with with_game_df.
     
     Args:
-        games_df (pd.DataFrame): DataFrame containing video game titles and genres.
+        games_df (pd.DataFrame): DataFrame containing video game titles and genres, or the games catalog.
         with_game_df (pd.DataFrame): DataFrame containing a 'video_game' column to match against titles.
     
     Returns:
         pl.DataFrame: A Polars DataFrame with the genres joined and rows with null 'Genres' dropped.
     """
     # Convert games_df to a Polars DataFrame
-    games_df_pl = pl.from_pandas(games_df)
+    games_df_pl = games_df if isinstance(games_df, pl.DataFrame) else pl.from_pandas(games_df)
 
     # Lowercase the titles in games_df
     games_df_lower = games_df_pl.with_columns(pl.col("Title").str.to_lowercase())
@@ -30,22 +32,39 @@ def join_games_with_genres(games_df, with_game_df):
 
     return merged_df
 
+def explode_genres(df):
+    """
+    Explodes the 'Genres' column, either a stringified list of genres (as in games.csv) or
+    a list of genres (as in the games catalog), into one row per genre.
+
+    Args:
+        df (pl.DataFrame): Polars DataFrame with a 'Genres' column.
+
+    Returns:
+        pl.DataFrame: A Polars DataFrame with one string genre per row.
+    """
+    if isinstance(df.schema["Genres"], pl.List):
+        return df.explode("Genres").with_columns(pl.col("Genres").cast(pl.String))
+
+    return (
+        df.with_columns(pl.col("Genres").str.split(","))
+        .explode("Genres")
+        .with_columns(pl.col("Genres").str.strip_chars("[]' ").alias("Genres"))
+    )
+
+
 def count_genre_occurrences(merged_df):
     """
     Explodes the 'Genres' column in merged_df and counts the occurrences of each genre.
 
     Args:
-        merged_df (pl.DataFrame): Polars DataFrame with a 'Genres' column containing comma-separated genres.
+        merged_df (pl.DataFrame): Polars DataFrame with a 'Genres' column containing comma-separated genres or lists of genres.
 
     Returns:
         pl.DataFrame: A Polars DataFrame with the genres and their corresponding counts, sorted in descending order.
     """
     # Explode the 'Genres' column after splitting by commas
-    exploded_genres_df = (
-        merged_df.with_columns(pl.col("Genres").str.split(","))
-        .explode("Genres")
-        .with_columns(pl.col("Genres").str.strip_chars("[]' ").alias("Genres"))
-    )
+    exploded_genres_df = explode_genres(merged_df)
 
     # Group by the 'Genres' column, count the occurrences, and sort in descending order
     genre_counts = (
@@ -70,7 +89,7 @@ def get_monthly_counts_by_top_genres(exploded_genres_df, genre_counts):
 
     # Round the 'upload_date' to the first day of the month
     clean_upload_dates_df = exploded_genres_df.with_columns(
-        pl.col("upload_date").str.to_date(format="%Y-%m-%d %H:%M:%S")
+        to_date("upload_date", exploded_genres_df.schema["upload_date"])
     ).with_columns(
         pl.col("upload_date").dt.month_start()
     )
@@ -97,12 +116,7 @@ def create_genre_cooccurrence_matrix(merged_df):
         pd.DataFrame: A genre co-occurrence matrix.
     """
     # Deduplicate by keeping one appearance of each video game
-    merged_df_unique = (
-        merged_df.unique(subset=["video_game"])
-        .with_columns(pl.col("Genres").str.split(","))
-        .explode("Genres")
-        .with_columns(pl.col("Genres").str.strip_chars("[]' ").alias("Genres"))
-    )
+    merged_df_unique = explode_genres(merged_df.unique(subset=["video_game"]))
 
     # Convert to pandas for creating the binary matrix
     merged_df_unique_pd = merged_df_unique.to_pandas()
@@ -0,0 +1,169 @@
+import os
+import polars as pl
+
+# Dictionary used to intern each ID column, 'video_id' in comments being a 'display_id'
+ID_COLUMNS = {
+    "channel_id": "channel_id",
+    "display_id": "display_id",
+    "video_id": "display_id",
+    "author": "author",
+}
+
+# Suffix of the columns holding the integer keys of the ID columns in the store
+KEY_SUFFIX = "_key"
+
+
+def build_id_dictionary(
+    videos_df: pl.DataFrame, comments_df: pl.DataFrame = None
+) -> dict[str, pl.DataFrame]:
+    """
+    Build the dictionaries mapping the string IDs of the filtered datasets to compact integer keys.
+
+    Args:
+        videos_df (pl.DataFrame | pl.LazyFrame): Filtered videos with 'channel_id' and 'display_id' columns.
+        comments_df (pl.DataFrame | pl.LazyFrame): Filtered comments with an 'author' column. Authors are
+            only interned if given and stored as strings. Defaults to None.
+
+    Returns:
+        dict[str, pl.DataFrame]: For each dictionary name, a DataFrame with the sorted unique IDs and
+        their 'key', which is the row number.
+    """
+    videos_lf = videos_df.lazy()
+    sources = {
+        "channel_id": videos_lf.select("channel_id"),
+        "display_id": videos_lf.select("display_id"),
+    }
+    if comments_df is not None and comments_df.lazy().collect_schema()["author"] == pl.String:
+        sources["author"] = comments_df.lazy().select("author")
+
+    frames = pl.collect_all(
+        [
+            source.unique().sort(name).with_row_index("key").select([name, "key"])
+            for name, source in sources.items()
+        ]
+    )
+    return dict(zip(sources.keys(), frames))
+
+
+def encode_ids(df, id_dictionary: dict[str, pl.DataFrame], columns: list[str] = None):
+    """
+    Replace the string ID columns of a DataFrame by their integer keys.
+
+    Args:
+        df (pl.DataFrame | pl.LazyFrame): DataFrame with ID columns.
+        id_dictionary (dict[str, pl.DataFrame]): Dictionaries returned by build_id_dictionary.
+        columns (list[str]): ID columns to encode. Defaults to all the known ID columns with a dictionary.
+
+    Returns:
+        pl.DataFrame | pl.LazyFrame: The DataFrame with integer keys, null for unknown IDs.
+    """
+    columns = columns or _id_columns(df, id_dictionary)
+    return df.with_columns([_encode_id(column, id_dictionary) for column in columns])
+
+
+def with_id_keys(df, id_dictionary: dict[str, pl.DataFrame], columns: list[str] = None):
+    """
+    Add the integer keys of the string ID columns of a DataFrame, as '{column}_key' columns.
+
+    Args:
+        df (pl.DataFrame | pl.LazyFrame): DataFrame with ID columns.
+        id_dictionary (dict[str, pl.DataFrame]): Dictionaries returned by build_id_dictionary.
+        columns (list[str]): ID columns to encode. Defaults to all the known ID columns with a dictionary.
+
+    Returns:
+        pl.DataFrame | pl.LazyFrame: The DataFrame with the key columns, null for unknown IDs.
+    """
+    columns = columns or _id_columns(df, id_dictionary)
+    return df.with_columns(
+        [_encode_id(column, id_dictionary).alias(column + KEY_SUFFIX) for column in columns]
+    )
+
+
+def _encode_id(column: str, id_dictionary: dict[str, pl.DataFrame]) -> pl.Expr:
+    """
+    Expression replacing the string IDs of a column by their integer keys.
+
+    Args:
+        column (str): Name of the ID column.
+        id_dictionary (dict[str, pl.DataFrame]): Dictionaries returned by build_id_dictionary.
+
+    Returns:
+        pl.Expr: The keys, null for unknown IDs.
+    """
+    dictionary_df = id_dictionary[ID_COLUMNS[column]]
+    return pl.col(column).replace_strict(
+        dictionary_df.get_column(ID_COLUMNS[column]), dictionary_df.get_column("key"), default=None
+    )
+
+
+def decode_ids(df, id_dictionary: dict[str, pl.DataFrame], columns: list[str] = None):
+    """
+    Resolve the integer keys of a DataFrame back to their string IDs, typically before exporting.
+
+    Args:
+        df (pl.DataFrame | pl.LazyFrame): DataFrame with integer keys in the ID columns.
+        id_dictionary (dict[str, pl.DataFrame]): Dictionaries returned by build_id_dictionary.
+        columns (list[str]): ID columns to decode. Defaults to all the known ID columns with a dictionary.
+
+    Returns:
+        pl.DataFrame | pl.LazyFrame: The DataFrame with string IDs.
+    """
+    columns = columns or _id_columns(df, id_dictionary)
+    return df.with_columns(
+        [
+            pl.col(column).replace_strict(
+                id_dictionary[ID_COLUMNS[column]].get_column("key"),
+                id_dictionary[ID_COLUMNS[column]].get_column(ID_COLUMNS[column]),
+                default=None,
+            )
+            for column in columns
+        ]
+    )
+
+
+def _id_columns(df, id_dictionary: dict[str, pl.DataFrame]) -> list[str]:
+    """
+    List the ID columns of a DataFrame which have a dictionary.
+
+    Args:
+        df (pl.DataFrame | pl.LazyFrame): DataFrame with ID columns.
+        id_dictionary (dict[str, pl.DataFrame]): Dictionaries returned by build_id_dictionary.
+
+    Returns:
+        list[str]: The ID columns.
+    """
+    return [
+        column
+        for column in df.lazy().collect_schema().names()
+        if column in ID_COLUMNS and ID_COLUMNS[column] in id_dictionary
+    ]
+
+
+def save_id_dictionary(id_dictionary: dict[str, pl.DataFrame], directory: str) -> None:
+    """
+    Save the ID dictionaries next to the filtered datasets, one parquet file per dictionary.
+
+    Args:
+        id_dictionary (dict[str, pl.DataFrame]): Dictionaries returned by build_id_dictionary.
+        directory (str): Directory of the filtered datasets.
+    """
+    os.makedirs(directory, exist_ok=True)
+    for name, dictionary_df in id_dictionary.items():
+        dictionary_df.write_parquet(os.path.join(directory, f"ids_{name}.parquet"))
+
+
+def load_id_dictionary(directory: str) -> dict[str, pl.DataFrame]:
+    """
+    Load the ID dictionaries saved by save_id_dictionary.
+
+    Args:
+        directory (str): Directory of the filtered datasets.
+
+    Returns:
+        dict[str, pl.DataFrame]: The ID dictionaries.
+    """
+    return {
+        name: pl.read_parquet(os.path.join(directory, f"ids_{name}.parquet"))
+        for name in set(ID_COLUMNS.values())
+        if os.path.exists(os.path.join(directory, f"ids_{name}.parquet"))
+    }
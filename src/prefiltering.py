@@ -0,0 +1,575 @@
+"""Prefiltering of the original YouNiverse files into the filtered datasets store."""
+
+import glob
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import time
+import numpy as np
+import polars as pl
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tqdm import tqdm
+
+from src.ids import ID_COLUMNS, build_id_dictionary, load_id_dictionary, save_id_dictionary
+from src.storage import (
+    PARTITIONING_VERSION,
+    add_id_keys,
+    clear_dataset,
+    convert_tsv_to_dataset,
+    scan_dataset,
+    write_dataset,
+)
+
+# Category of the videos kept by the prefiltering
+GAMING_CATEGORY = "Gaming"
+
+# Fields of yt_metadata_en.jsonl parsed by the ingestion, others are skipped
+VIDEOS_JSON_SCHEMA = {
+    "categories": pl.String,
+    "title": pl.String,
+    "tags": pl.String,
+    "upload_date": pl.String,
+    "view_count": pl.Float64,
+    "like_count": pl.Float64,
+    "dislike_count": pl.Float64,
+    "duration": pl.Float64,
+    "channel_id": pl.String,
+    "display_id": pl.String,
+}
+
+
+def _parse_videos_batch(lines: list[bytes]) -> pl.DataFrame:
+    """
+    Parse a batch of yt_metadata_en.jsonl lines, keeping the gaming videos and the needed columns only.
+
+    Args:
+        lines (list[bytes]): The JSON lines, each ending with a newline.
+
+    Returns:
+        pl.DataFrame: The gaming videos of the batch.
+    """
+    return (
+        pl.read_ndjson(io.BytesIO(b"".join(lines)), schema=VIDEOS_JSON_SCHEMA)
+        .filter(pl.col("categories") == GAMING_CATEGORY)
+        .with_columns(pl.col(pl.String).fill_null(""))
+        .drop("categories")
+    )
+
+
+def ingest_gaming_videos(
+    jsonl_path: str, root: str, helper_path: str = None, batch_size: int = 200_000
+) -> int:
+    """
+    Stream yt_metadata_en.jsonl into the videos dataset of the store, keeping only gaming videos.
+
+    The file is read line by line and parsed in batches of gaming candidates, so the memory used does not
+    depend on the size of the file. With the feather helper, which lists the category of every video in
+    the same order as the JSON lines, non-gaming lines are skipped without being parsed. Otherwise, lines
+    not containing the category string are skipped before parsing.
+
+    Args:
+        jsonl_path (str): Path to yt_metadata_en.jsonl.
+        root (str): Root directory of the store.
+        helper_path (str): Path to yt_metadata_helper.feather. Defaults to None.
+        batch_size (int): Number of candidate lines parsed at once. Defaults to 200 000.
+
+    Returns:
+        int: The number of gaming videos written.
+    """
+    if helper_path is not None:
+        is_gaming = (
+            pl.scan_ipc(helper_path)
+            .select(pl.col("categories") == GAMING_CATEGORY)
+            .collect()
+            .to_series()
+            .fill_null(False)
+            .to_numpy()
+        )
+    else:
+        is_gaming = None
+    category_bytes = f'"{GAMING_CATEGORY}"'.encode()
+
+    clear_dataset("videos", root)
+    start = time.perf_counter()
+    lines = []
+    part = 0
+    n_lines = 0
+    n_videos = 0
+
+    with open(jsonl_path, "rb") as f, tqdm(desc="Ingesting videos", unit=" lines") as progress_bar:
+        for n_lines, line in enumerate(f, start=1):
+            if is_gaming is not None:
+                if n_lines > len(is_gaming):
+                    raise ValueError("The feather helper has fewer rows than the JSON lines file.")
+                keep = is_gaming[n_lines - 1]
+            else:
+                keep = category_bytes in line
+            if keep:
+                lines.append(line if line.endswith(b"\n") else line + b"\n")
+
+            if len(lines) >= batch_size:
+                videos_df = _parse_videos_batch(lines)
+                write_dataset(videos_df, "videos", root, part)
+                n_videos += len(videos_df)
+                part += 1
+                lines = []
+            if n_lines % 100_000 == 0:
+                progress_bar.update(100_000)
+
+        if lines:
+            videos_df = _parse_videos_batch(lines)
+            write_dataset(videos_df, "videos", root, part)
+            n_videos += len(videos_df)
+        progress_bar.update(n_lines % 100_000)
+
+    if is_gaming is not None and n_lines != len(is_gaming):
+        raise ValueError("The feather helper and the JSON lines file have a different number of rows.")
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"{n_videos} gaming videos out of {n_lines} written in {elapsed:.1f}s "
+        f"({n_lines / max(elapsed, 1e-9):,.0f} rows/s)"
+    )
+    return n_videos
+
+
+def build_bloom_filter(ids: pl.Series, false_positive_rate: float = 0.01) -> tuple[np.ndarray, int]:
+    """
+    Build a Bloom filter of a set of IDs, as a packed bit array.
+
+    Args:
+        ids (pl.Series): The IDs to insert.
+        false_positive_rate (float): Target rate of false positives. Defaults to 0.01.
+
+    Returns:
+        tuple[np.ndarray, int]: The packed bits and the number of hash functions.
+    """
+    n_ids = max(len(ids), 1)
+    n_bits = 8 * int(np.ceil(-n_ids * np.log(false_positive_rate) / np.log(2) ** 2 / 8))
+    n_hashes = max(1, int(round(n_bits / n_ids * np.log(2))))
+
+    bits = np.zeros(n_bits // 8, dtype=np.uint8)
+    for positions in _bloom_positions(ids, n_bits, n_hashes):
+        np.bitwise_or.at(bits, positions >> 3, (1 << (positions & 7)).astype(np.uint8))
+
+    return bits, n_hashes
+
+
+def bloom_filter_contains(ids: pl.Series, bloom_filter: tuple[np.ndarray, int]) -> np.ndarray:
+    """
+    Check which IDs may be in a Bloom filter. IDs of the filter are always found, other IDs are only
+    found at the false positive rate of the filter.
+
+    Args:
+        ids (pl.Series): The IDs to check.
+        bloom_filter (tuple[np.ndarray, int]): The filter returned by build_bloom_filter.
+
+    Returns:
+        np.ndarray: Boolean mask of the IDs which may be in the filter.
+    """
+    bits, n_hashes = bloom_filter
+    found = np.ones(len(ids), dtype=bool)
+    for positions in _bloom_positions(ids, len(bits) * 8, n_hashes):
+        found &= ((bits[positions >> 3] >> (positions & 7)) & 1).astype(bool)
+    return found
+
+
+def _bloom_positions(ids: pl.Series, n_bits: int, n_hashes: int):
+    """
+    Yield the bit positions of the IDs for each hash function, using double hashing.
+
+    Args:
+        ids (pl.Series): The IDs.
+        n_bits (int): Size of the filter in bits.
+        n_hashes (int): Number of hash functions.
+
+    Yields:
+        np.ndarray: The bit positions of the IDs for one hash function.
+    """
+    first_hash = ids.hash(seed=1).to_numpy() % np.uint64(n_bits)
+    second_hash = ids.hash(seed=2).to_numpy() % np.uint64(n_bits)
+    for i in range(n_hashes):
+        yield ((first_hash + np.uint64(i) * second_hash) % np.uint64(n_bits)).astype(np.int64)
+
+
+# Video IDs and Bloom filter of the current worker process, set by _init_comments_worker
+_worker_video_ids = None
+_worker_bloom_filter = None
+
+
+def _init_comments_worker(video_ids: pl.Series, bloom_filter: tuple) -> None:
+    """
+    Store the gaming video IDs once in a worker process of the comments prefilter.
+
+    Args:
+        video_ids (pl.Series): The gaming video IDs.
+        bloom_filter (tuple): The Bloom filter of the video IDs, or None.
+    """
+    global _worker_video_ids, _worker_bloom_filter
+    _worker_video_ids = video_ids.to_frame("video_id")
+    _worker_bloom_filter = bloom_filter
+
+
+def _filter_comments_range(
+    comments_path: str, start: int, end: int, header: list[str], separator: str, part_path: str
+) -> tuple[int, int]:
+    """
+    Filter the comments of a byte range of the comments file on the gaming video IDs, and write them
+    without header to a part file.
+
+    Args:
+        comments_path (str): Path to the comments file.
+        start (int): Offset of the first line of the range.
+        end (int): Offset of the end of the range, at the end of a line.
+        header (list[str]): Column names of the comments file.
+        separator (str): Separator of the comments file.
+        part_path (str): Path of the part file to write.
+
+    Returns:
+        tuple[int, int]: The number of comments read and kept.
+    """
+    with open(comments_path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+
+    # Keep the values as text so that they are written back unchanged
+    comments_df = pl.read_csv(
+        io.BytesIO(data),
+        separator=separator,
+        has_header=False,
+        new_columns=header,
+        infer_schema=False,
+    ).select(["author", "video_id"])
+    n_comments = len(comments_df)
+
+    if _worker_bloom_filter is not None:
+        comments_df = comments_df.filter(
+            bloom_filter_contains(comments_df.get_column("video_id"), _worker_bloom_filter)
+        )
+    comments_df = comments_df.join(_worker_video_ids, on="video_id", how="semi")
+
+    comments_df.write_csv(part_path, separator=separator, include_header=False)
+    return n_comments, len(comments_df)
+
+
+def prefilter_comments(
+    comments_path: str,
+    video_ids: pl.Series,
+    output_path: str,
+    n_workers: int = 1,
+    chunk_bytes: int = 256_000_000,
+    use_bloom_filter: bool = False,
+    separator: str = "\t",
+) -> int:
+    """
+    Keep the 'author' and 'video_id' of the comments posted under gaming videos, as the prefiltering
+    notebook does, without building a Python set of the video IDs.
+
+    The comments file is split into line-aligned byte ranges which are semi-joined with the video IDs,
+    optionally after a cheap rejection by a Bloom filter, across a pool of processes. The parts are then
+    concatenated in order, so the output is the same as a sequential scan.
+
+    Args:
+        comments_path (str): Path to youtube_comments.tsv.
+        video_ids (pl.Series): The 'display_id' of the gaming videos.
+        output_path (str): Path of the filtered comments file.
+        n_workers (int): Number of processes to use, None for one per CPU. Defaults to 1.
+        chunk_bytes (int): Approximate size of the byte ranges. Defaults to 256MB.
+        use_bloom_filter (bool): Whether to reject comments with a Bloom filter before the join. Defaults to False.
+        separator (str): Separator of the comments file. Defaults to tab.
+
+    Returns:
+        int: The number of comments kept.
+    """
+    video_ids = video_ids.cast(pl.String).unique()
+    bloom_filter = build_bloom_filter(video_ids) if use_bloom_filter else None
+
+    # Split the file into byte ranges ending at line boundaries
+    file_size = os.path.getsize(comments_path)
+    with open(comments_path, "rb") as f:
+        header_line = f.readline()
+        boundaries = [f.tell()]
+        while boundaries[-1] < file_size:
+            f.seek(min(boundaries[-1] + chunk_bytes, file_size))
+            f.readline()
+            boundaries.append(min(f.tell(), file_size))
+    header = header_line.decode().rstrip("\r\n").split(separator)
+    ranges = list(zip(boundaries[:-1], boundaries[1:]))
+    part_paths = [f"{output_path}.part{i}" for i in range(len(ranges))]
+
+    start = time.perf_counter()
+    n_read = 0
+    n_kept = 0
+    with ProcessPoolExecutor(
+        max_workers=n_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_comments_worker,
+        initargs=(video_ids, bloom_filter),
+    ) as executor, tqdm(total=file_size, desc="Filtering comments", unit="B", unit_scale=True) as progress_bar:
+        futures = {
+            executor.submit(
+                _filter_comments_range, comments_path, range_start, range_end, header, separator, part_path
+            ): range_end - range_start
+            for (range_start, range_end), part_path in zip(ranges, part_paths)
+        }
+        for future in as_completed(futures):
+            n_range_read, n_range_kept = future.result()
+            n_read += n_range_read
+            n_kept += n_range_kept
+            progress_bar.update(futures[future])
+
+    # Concatenate the parts in order after the header
+    with open(output_path, "wb") as output:
+        output.write(f"author{separator}video_id\n".encode())
+        for part_path in part_paths:
+            with open(part_path, "rb") as part:
+                shutil.copyfileobj(part, output)
+            os.remove(part_path)
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"{n_kept} comments out of {n_read} kept in {elapsed:.1f}s "
+        f"({n_read / max(elapsed, 1e-9):,.0f} rows/s)"
+    )
+    return n_kept
+
+
+# Columns kept from df_channels_en.tsv, with their new names
+CHANNELS_COLUMNS = {
+    "channel": "channel_id",
+    "name_cc": "channel_name",
+    "subscribers_cc": "subscribers",
+    "videos_cc": "videos",
+}
+
+# Columns kept from df_timeseries_en.tsv, with their new names
+TIMESERIES_COLUMNS = {
+    "channel": "channel_id",
+    "datetime": "datetime",
+    "views": "views",
+    "delta_views": "delta_views",
+    "subs": "subs",
+    "delta_subs": "delta_subs",
+    "videos": "videos",
+    "delta_videos": "delta_videos",
+}
+
+# Original files read, filter definition and upstream datasets of each filtered dataset, in build order
+PREFILTERING_STEPS = {
+    "videos": {
+        "sources": ["videos"],
+        "definition": {"category": GAMING_CATEGORY, "columns": list(VIDEOS_JSON_SCHEMA)},
+        "depends_on": [],
+    },
+    # Dictionaries of the string IDs of the videos (see src.ids), saved in the 'ids' directory of the store
+    "ids": {
+        "sources": [],
+        "definition": {"columns": ID_COLUMNS},
+        "depends_on": ["videos"],
+    },
+    "channels": {
+        "sources": ["channels"],
+        "definition": {"columns": CHANNELS_COLUMNS},
+        "depends_on": ["videos", "ids"],
+    },
+    "timeseries": {
+        "sources": ["timeseries"],
+        "definition": {"columns": TIMESERIES_COLUMNS, "partitioning": PARTITIONING_VERSION},
+        "depends_on": ["videos", "ids"],
+    },
+    "comments": {
+        "sources": ["comments"],
+        "definition": {"columns": ["author", "video_id"], "partitioning": PARTITIONING_VERSION},
+        "depends_on": ["videos", "ids"],
+    },
+}
+
+
+def file_hash(path: str, previous: dict = None) -> dict:
+    """
+    Compute the content hash of a file, reusing the previous hash if its size and modification time
+    did not change.
+
+    Args:
+        path (str): Path of the file.
+        previous (dict): Previous result of file_hash for the same file. Defaults to None.
+
+    Returns:
+        dict: The 'size', 'mtime_ns' and 'hash' of the file.
+    """
+    stat = os.stat(path)
+    if previous and previous["size"] == stat.st_size and previous["mtime_ns"] == stat.st_mtime_ns:
+        return previous
+
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        while chunk := f.read(8 * 1024 * 1024):
+            digest.update(chunk)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": digest.hexdigest()}
+
+
+def dataset_hash(name: str, root: str) -> str:
+    """
+    Compute the content hash of all the files of a dataset of the store.
+
+    Args:
+        name (str): Name of the dataset.
+        root (str): Root directory of the store.
+
+    Returns:
+        str: The hash of the dataset.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    dataset_dir = os.path.join(root, name)
+    for path in sorted(glob.glob(os.path.join(dataset_dir, "**", "*.parquet"), recursive=True)):
+        digest.update(os.path.relpath(path, dataset_dir).encode())
+        digest.update(file_hash(path)["hash"].encode())
+    return digest.hexdigest()
+
+
+def filter_gaming_channels(channels_path: str, channel_ids: pl.Series, root: str) -> None:
+    """
+    Write the channels of the gaming videos to the channels dataset of the store.
+
+    Args:
+        channels_path (str): Path to df_channels_en.tsv.
+        channel_ids (pl.Series): The 'channel_id' of the gaming videos.
+        root (str): Root directory of the store.
+    """
+    channels_df = (
+        pl.scan_csv(channels_path, separator="\t")
+        .filter(pl.col("channel").is_in(channel_ids))
+        .select(list(CHANNELS_COLUMNS))
+        .rename(CHANNELS_COLUMNS)
+        .collect()
+    )
+    clear_dataset("channels", root)
+    write_dataset(channels_df, "channels", root)
+
+
+def filter_gaming_timeseries(timeseries_path: str, channel_ids: pl.Series, root: str) -> None:
+    """
+    Write the timeseries of the channels of the gaming videos to the timeseries dataset of the store.
+
+    Args:
+        timeseries_path (str): Path to df_timeseries_en.tsv.
+        channel_ids (pl.Series): The 'channel_id' of the gaming videos.
+        root (str): Root directory of the store.
+    """
+    timeseries_df = (
+        pl.scan_csv(timeseries_path, separator="\t")
+        .filter(pl.col("channel").is_in(channel_ids))
+        .select(list(TIMESERIES_COLUMNS))
+        .rename(TIMESERIES_COLUMNS)
+        .collect(streaming=True)
+    )
+    clear_dataset("timeseries", root)
+    write_dataset(timeseries_df, "timeseries", root)
+
+
+def run_prefiltering(
+    original_paths: dict[str, str],
+    root: str,
+    helper_path: str = None,
+    n_workers: int = 1,
+    force: bool = False,
+) -> dict:
+    """
+    Build the filtered datasets of the store from the original YouNiverse files, only rebuilding the
+    datasets whose original files, filter definition or upstream datasets changed since the last run.
+
+    A manifest in the store records, for each dataset, the content hashes of its original files, the
+    hash of its filter definition, the output hashes of the datasets it depends on (the channels,
+    timeseries and comments depend on the gaming videos) and its own row count and output hash. It is
+    saved after each dataset, so an interrupted run resumes from the last completed one. The ID
+    dictionaries of the videos are tracked the same way and saved in the 'ids' directory of the store,
+    to be loaded with src.ids.load_id_dictionary, and the integer keys of the IDs are stored in every
+    dataset (see src.storage.scan_dataset).
+
+    Args:
+        original_paths (dict[str, str]): Paths of the original 'videos', 'channels', 'timeseries' and 'comments' files.
+        root (str): Root directory of the store.
+        helper_path (str): Path to yt_metadata_helper.feather, used to skip non-gaming videos. Defaults to None.
+        n_workers (int): Number of processes used to filter the comments. Defaults to 1.
+        force (bool): Whether to rebuild all the datasets. Defaults to False.
+
+    Returns:
+        dict: The manifest.
+    """
+    manifest_path = os.path.join(root, "manifest.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    else:
+        manifest = {"sources": {}, "datasets": {}}
+
+    for name, step in PREFILTERING_STEPS.items():
+        # Fingerprint everything the dataset is built from
+        for source in step["sources"]:
+            manifest["sources"][source] = file_hash(
+                original_paths[source], manifest["sources"].get(source)
+            )
+        record = {
+            "sources": {source: manifest["sources"][source]["hash"] for source in step["sources"]},
+            "definition": hashlib.blake2b(
+                json.dumps(step["definition"], sort_keys=True).encode(), digest_size=16
+            ).hexdigest(),
+            "depends_on": {
+                dependency: manifest["datasets"][dependency]["output"]["hash"]
+                for dependency in step["depends_on"]
+            },
+        }
+
+        previous = manifest["datasets"].get(name)
+        if (
+            not force
+            and previous is not None
+            and all(previous[key] == record[key] for key in record)
+            and previous["output"]["hash"] == dataset_hash(name, root)
+        ):
+            print(f"{name}: up to date")
+            continue
+
+        print(f"{name}: rebuilding")
+        if name == "videos":
+            ingest_gaming_videos(original_paths["videos"], root, helper_path)
+        elif name == "ids":
+            id_dictionary = build_id_dictionary(scan_dataset("videos", root))
+            clear_dataset(name, root)
+            save_id_dictionary(id_dictionary, os.path.join(root, name))
+
+            # Store the keys in the videos, the datasets depending on them from now on
+            add_id_keys("videos", root, id_dictionary)
+            manifest["datasets"]["videos"]["output"]["hash"] = dataset_hash("videos", root)
+            record["depends_on"]["videos"] = manifest["datasets"]["videos"]["output"]["hash"]
+        else:
+            videos_lf = scan_dataset("videos", root)
+            if name == "channels":
+                channel_ids = videos_lf.select("channel_id").unique().collect().to_series()
+                filter_gaming_channels(original_paths["channels"], channel_ids, root)
+            elif name == "timeseries":
+                channel_ids = videos_lf.select("channel_id").unique().collect().to_series()
+                filter_gaming_timeseries(original_paths["timeseries"], channel_ids, root)
+            elif name == "comments":
+                comments_path = os.path.join(root, "gaming_comments.tsv")
+                video_ids = videos_lf.select("display_id").collect().to_series()
+                prefilter_comments(original_paths["comments"], video_ids, comments_path, n_workers)
+                convert_tsv_to_dataset(comments_path, "comments", root)
+                os.remove(comments_path)
+            add_id_keys(name, root, load_id_dictionary(os.path.join(root, "ids")))
+
+        if name == "ids":
+            rows = sum(dictionary_df.height for dictionary_df in id_dictionary.values())
+        else:
+            rows = scan_dataset(name, root).select(pl.len()).collect().item()
+        record["output"] = {"rows": rows, "hash": dataset_hash(name, root)}
+        manifest["datasets"][name] = record
+
+        # Checkpoint the manifest after each dataset
+        with open(manifest_path, "w") as f:
+            json.dump(manifest, f, indent=4)
+
+    return manifest
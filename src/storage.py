@@ -0,0 +1,294 @@
+"""Parquet storage layer for the filtered YouNiverse datasets."""
+
+import glob
+import os
+import shutil
+import string
+import polars as pl
+from tqdm import tqdm
+
+from src.ids import ID_COLUMNS, KEY_SUFFIX, with_id_keys
+
+# Number of buckets of the datasets partitioned by ID
+N_BUCKETS = 32
+
+# Alphabet of the YouTube IDs, the character following the 'UC' prefix of the channel IDs being uniformly distributed
+ID_ALPHABET = string.ascii_uppercase + string.ascii_lowercase + string.digits + "-_"
+
+# Version of the partitioning of the datasets, to bump whenever a partition key changes
+PARTITIONING_VERSION = 2
+
+# Hive partition value used for null keys
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+# Format of the timestamps in the original files
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Column types, partition key and temporal sort column of each dataset
+DATASETS = {
+    "videos": {
+        "schema": {
+            "title": pl.String,
+            "tags": pl.String,
+            "upload_date": pl.Datetime,
+            "view_count": pl.Int64,
+            "like_count": pl.Int64,
+            "dislike_count": pl.Int64,
+            "duration": pl.Int64,
+            "channel_id": pl.String,
+            "display_id": pl.String,
+        },
+        "partition": pl.col("upload_date").cast(pl.String).str.slice(0, 7).alias("upload_month"),
+        "sort": "upload_date",
+    },
+    "channels": {
+        "schema": {
+            "channel_id": pl.String,
+            "channel_name": pl.String,
+            "subscribers": pl.Int64,
+            "videos": pl.Int64,
+        },
+        "partition": None,
+        "sort": None,
+    },
+    "timeseries": {
+        "schema": {
+            "channel_id": pl.String,
+            "datetime": pl.Datetime,
+            "views": pl.Float64,
+            "delta_views": pl.Float64,
+            "subs": pl.Float64,
+            "delta_subs": pl.Float64,
+            "videos": pl.Int64,
+            "delta_videos": pl.Int64,
+        },
+        # Stable across Polars versions, unlike Expr.hash
+        "partition": (
+            pl.col("channel_id")
+            .str.slice(2, 1)
+            .replace_strict(list(ID_ALPHABET), range(len(ID_ALPHABET)), default=0, return_dtype=pl.Int64)
+            % N_BUCKETS
+        ).alias("channel_bucket"),
+        "sort": "datetime",
+    },
+    "comments": {
+        "schema": {
+            "video_id": pl.String,
+        },
+        # The authors are anonymized integers
+        "partition": (pl.col("author") % N_BUCKETS).alias("author_bucket"),
+        "sort": None,
+    },
+}
+
+
+def cast_dataset(df, name: str):
+    """
+    Cast the columns of a dataset to their storage types, parsing the timestamps stored as strings.
+    Columns without a declared type are kept as is.
+
+    Args:
+        df (pl.DataFrame | pl.LazyFrame): The dataset.
+        name (str): Name of the dataset, one of DATASETS.
+
+    Returns:
+        pl.DataFrame | pl.LazyFrame: The dataset with typed columns.
+    """
+    columns = df.lazy().collect_schema()
+    schema = DATASETS[name]["schema"]
+    parsed = [
+        column
+        for column, dtype in schema.items()
+        if column in columns and dtype == pl.Datetime and columns[column] == pl.String
+    ]
+    df = df.with_columns(
+        pl.col(column).str.to_datetime(DATETIME_FORMAT, strict=False) for column in parsed
+    )
+    return df.cast(
+        {column: dtype for column, dtype in schema.items() if column in columns and column not in parsed},
+        strict=False,
+    )
+
+
+def sort_dataset(df, name: str):
+    """
+    Sort a dataset by its temporal column, keeping the order of the rows with the same timestamp, so that
+    it is flagged as sorted and range filters and as-of joins on it do not sort again.
+
+    Args:
+        df (pl.DataFrame | pl.LazyFrame): The dataset.
+        name (str): Name of the dataset, one of DATASETS.
+
+    Returns:
+        pl.DataFrame | pl.LazyFrame: The sorted dataset, unchanged if it has no temporal column.
+    """
+    sort_column = DATASETS[name]["sort"]
+    if sort_column is None or sort_column not in df.lazy().collect_schema().names():
+        return df
+    return df.sort(sort_column, maintain_order=True)
+
+
+def _csv_schema(name: str) -> dict:
+    """
+    Column types to read a dataset from a TSV file. Timestamps are read as strings and integers as floats, as
+    the filtered TSV files written from read_ndjson hold counts such as '1057.0', and both are converted by
+    cast_dataset.
+
+    Args:
+        name (str): Name of the dataset, one of DATASETS.
+
+    Returns:
+        dict: The column types.
+    """
+    on_disk = {pl.Datetime: pl.String, pl.Int64: pl.Float64}
+    return {
+        column: on_disk.get(dtype, dtype)
+        for column, dtype in DATASETS[name]["schema"].items()
+    }
+
+
+def clear_dataset(name: str, root: str) -> None:
+    """
+    Remove all the files of a dataset from the store.
+
+    Args:
+        name (str): Name of the dataset, one of DATASETS.
+        root (str): Root directory of the store.
+    """
+    shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+
+def write_dataset(df: pl.DataFrame, name: str, root: str, part: int = 0) -> None:
+    """
+    Write a dataset, or one part of it, as typed zstd-compressed Parquet files, partitioned in
+    hive-style directories by the partition key of the dataset.
+
+    Args:
+        df (pl.DataFrame): The dataset, or a batch of it.
+        name (str): Name of the dataset, one of DATASETS.
+        root (str): Root directory of the store.
+        part (int): Number of the part, to write a dataset in several batches. Defaults to 0.
+    """
+    df = cast_dataset(df, name)
+    partition = DATASETS[name]["partition"]
+
+    if partition is None:
+        os.makedirs(os.path.join(root, name), exist_ok=True)
+        df.write_parquet(os.path.join(root, name, f"part-{part}.parquet"), compression="zstd")
+        return
+
+    key = partition.meta.output_name()
+    partitions = df.with_columns(partition).partition_by(key, as_dict=True, include_key=False)
+    for (value,), partition_df in partitions.items():
+        path = os.path.join(root, name, f"{key}={NULL_PARTITION if value is None else value}")
+        os.makedirs(path, exist_ok=True)
+        partition_df.write_parquet(os.path.join(path, f"part-{part}.parquet"), compression="zstd")
+
+
+def convert_tsv_to_dataset(
+    tsv_path: str, name: str, root: str, batch_size: int = 5_000_000
+) -> None:
+    """
+    Convert a filtered TSV file to a dataset of the store, reading it by batches.
+
+    Args:
+        tsv_path (str): Path of the TSV file.
+        name (str): Name of the dataset, one of DATASETS.
+        root (str): Root directory of the store.
+        batch_size (int): Number of rows read at once. Defaults to 5 000 000.
+    """
+    clear_dataset(name, root)
+
+    reader = pl.read_csv_batched(
+        tsv_path,
+        separator="\t",
+        schema_overrides=_csv_schema(name),
+        batch_size=batch_size,
+    )
+    part = 0
+    with tqdm(desc=f"Converting {name}", unit=" rows") as progress_bar:
+        while batches := reader.next_batches(1):
+            write_dataset(batches[0], name, root, part)
+            progress_bar.update(len(batches[0]))
+            part += 1
+
+
+def read_tsv(tsv_path: str, name: str) -> pl.DataFrame:
+    """
+    Read a filtered TSV file with the column types of a dataset of the store, sorted by its temporal column.
+
+    Args:
+        tsv_path (str): Path of the TSV file.
+        name (str): Name of the dataset, one of DATASETS.
+
+    Returns:
+        pl.DataFrame: The dataset.
+    """
+    df = pl.read_csv(tsv_path, separator="\t", schema_overrides=_csv_schema(name))
+    return sort_dataset(cast_dataset(df, name), name)
+
+
+def add_id_keys(name: str, root: str, id_dictionary: dict[str, pl.DataFrame]) -> None:
+    """
+    Store the integer keys of the ID columns of a dataset next to them, as '{column}_key' columns,
+    rewriting its files one by one.
+
+    Args:
+        name (str): Name of the dataset, one of DATASETS.
+        root (str): Root directory of the store.
+        id_dictionary (dict[str, pl.DataFrame]): ID dictionaries of the store (see src.ids).
+    """
+    for path in glob.glob(os.path.join(root, name, "**", "*.parquet"), recursive=True):
+        df = pl.read_parquet(path, hive_partitioning=False)
+        with_id_keys(df, id_dictionary).write_parquet(path, compression="zstd")
+
+
+def scan_dataset(name: str, root: str, keys: bool = False) -> pl.LazyFrame:
+    """
+    Lazily scan a dataset of the store. Selections and filters applied to the returned LazyFrame are
+    pushed down to the Parquet reader, and filters on the partition key skip whole directories.
+
+    Args:
+        name (str): Name of the dataset, one of DATASETS.
+        root (str): Root directory of the store.
+        keys (bool): Whether to read the integer keys stored by add_id_keys in place of the string IDs,
+            so that only the keys are loaded. Defaults to False.
+
+    Returns:
+        pl.LazyFrame: The dataset, with its partition key as a column.
+    """
+    dataset_lf = pl.scan_parquet(
+        os.path.join(root, name, "**", "*.parquet"),
+        hive_partitioning=DATASETS[name]["partition"] is not None,
+    )
+    columns = dataset_lf.collect_schema().names()
+    id_keys = {column: column + KEY_SUFFIX for column in ID_COLUMNS if column + KEY_SUFFIX in columns}
+    return dataset_lf.select(
+        pl.col(id_keys[column]).alias(column) if keys and column in id_keys else pl.col(column)
+        for column in columns
+        if column not in id_keys.values()
+    )
+
+
+def read_dataset(
+    name: str, root: str, columns: list[str] = None, predicate: pl.Expr = None, keys: bool = False
+) -> pl.DataFrame:
+    """
+    Read the given columns and rows of a dataset of the store, sorted by its temporal column.
+
+    Args:
+        name (str): Name of the dataset, one of DATASETS.
+        root (str): Root directory of the store.
+        columns (list[str]): Columns to read. Defaults to all of them.
+        predicate (pl.Expr): Filter on the rows to read. Defaults to None.
+        keys (bool): Whether to read the integer keys in place of the string IDs (see scan_dataset). Defaults to False.
+
+    Returns:
+        pl.DataFrame: The dataset.
+    """
+    dataset_lf = scan_dataset(name, root, keys)
+    if predicate is not None:
+        dataset_lf = dataset_lf.filter(predicate)
+    if columns is not None:
+        dataset_lf = dataset_lf.select(columns)
+    return sort_dataset(dataset_lf, name).collect()
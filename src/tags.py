@@ -1,31 +1,90 @@
 import polars as pl
 
-def get_tags(videos_sample_df):
+def count_tags(videos_df: pl.DataFrame) -> pl.DataFrame:
     """
-    Processes the 'tags' column in the DataFrame and returns the tags and their counts.
+    Lowercases, splits and counts the tags of the videos.
     Args:
-        videos_sample_df (pl.DataFrame): The DataFrame containing a 'tags' column.
+        videos_df (pl.DataFrame): The DataFrame containing a 'tags' column.
     Returns:
-        pl.DataFrame: A DataFrame with the tags and their counts.
+        pl.DataFrame: A DataFrame with the tags and their counts, unsorted.
     """
-    # Process tags
-    tags = (
-        videos_sample_df
+    return (
+        videos_df
         .select('tags')
         .with_columns(pl.col("tags").str.to_lowercase())   # Convert to lowercase
         .with_columns(pl.col("tags").str.split(","))       # Split tags by comma
         .explode("tags")                                   # Explode to create a row for each tag
         .group_by("tags")                                  # Group by unique tags
-        .count()                                           # Count occurrences of each tag
-        .sort("count", descending=True)                   # Sort by count in descending order
+        .len("count")                                      # Count occurrences of each tag
     )
-    
-    return tags
 
 
+def merge_heavy_hitters(summary_df: pl.DataFrame, counts_df: pl.DataFrame, capacity: int) -> pl.DataFrame:
+    """
+    Merges tag counts into a Misra-Gries summary of at most capacity tags. When there are more tags, the
+    (capacity + 1)-th largest count is subtracted from all of them and only the positive ones are kept, so
+    each count is underestimated by at most the total count divided by (capacity + 1).
+    Args:
+        summary_df (pl.DataFrame): The summary, with 'tags' and 'count' columns.
+        counts_df (pl.DataFrame): The tag counts to merge, with 'tags' and 'count' columns.
+        capacity (int): Maximum number of tags in the summary.
+    Returns:
+        pl.DataFrame: The merged summary.
+    """
+    merged_df = (
+        pl.concat([summary_df, counts_df])
+        .group_by("tags")
+        .agg(pl.col("count").sum())
+        .sort("count", descending=True)
+    )
+    if merged_df.height <= capacity:
+        return merged_df
 
+    decrement = merged_df.get_column("count")[capacity]
+    return (
+        merged_df.head(capacity)
+        .with_columns(pl.col("count") - decrement)
+        .filter(pl.col("count") > 0)
+    )
 
 
+def get_tags(
+    videos_sample_df,
+    top_k: int = None,
+    batch_size: int = 1_000_000,
+    capacity: int = None,
+    verify: bool = True,
+):
+    """
+    Processes the 'tags' column in the DataFrame and returns the tags and their counts.
+    Args:
+        videos_sample_df (pl.DataFrame): The DataFrame containing a 'tags' column.
+        top_k (int): Number of most frequent tags to return. If given, the videos are processed by batches into a
+            bounded heavy-hitters summary instead of counting all the tags at once. Defaults to None, returning all the tags.
+        batch_size (int): Number of videos per batch when top_k is given. Defaults to 1 000 000.
+        capacity (int): Number of tags kept in the summary, the larger the more accurate. Defaults to 10 * top_k.
+        verify (bool): Whether to count the candidate tags of the summary exactly in a second pass. The counts are then
+            exact, otherwise they are lower bounds. In both cases, every tag occurring more than the total number of
+            tags divided by (capacity + 1) times is a candidate. Defaults to True.
+    Returns:
+        pl.DataFrame: A DataFrame with the tags and their counts.
+    """
+    if top_k is None:
+        return count_tags(videos_sample_df).sort("count", descending=True)  # Sort by count in descending order
 
+    capacity = capacity or 10 * top_k
+    summary_df = pl.DataFrame(schema={"tags": pl.String, "count": pl.UInt32})
+    for batch_df in videos_sample_df.iter_slices(batch_size):
+        summary_df = merge_heavy_hitters(summary_df, count_tags(batch_df), capacity)
 
+    if verify:
+        # Count the candidates exactly
+        candidates = summary_df.get_column("tags")
+        summary_df = pl.concat(
+            [
+                count_tags(batch_df).filter(pl.col("tags").is_in(candidates))
+                for batch_df in videos_sample_df.iter_slices(batch_size)
+            ]
+        ).group_by("tags").agg(pl.col("count").sum())
 
+    return summary_df.sort("count", descending=True).head(top_k)
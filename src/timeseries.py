@@ -1,18 +1,29 @@
+import numpy as np
 import pandas as pd
 import polars as pl
 import matplotlib.pyplot as plt
 import json
 import plotly.graph_objects as go
 
+from src.utils import collect_like
+
+# Metrics of the channels timeseries
+METRICS = ["views", "delta_views", "subs", "delta_subs", "videos", "delta_videos"]
+
+# Truncation interval of each granularity of the rollup, keyed by pandas period alias
+ROLLUP_PERIODS = {"D": "1d", "W": "1w", "M": "1mo"}
+
 
 def games_timeseries(channels_top_game_df: pl.DataFrame, timeseries_df: pl.DataFrame):
     """
     Compute the time series of views, subs and videos for each top game.
     Args:
-        channels_top_game_df (pl.DataFrame): Polars DataFrame with columns channel_id and top_game.
-        timeseries_df (pl.DataFrame): Polars DataFrame with columns channel_id, datetime, views, subs, videos.
+        channels_top_game_df (pl.DataFrame | pl.LazyFrame): Polars DataFrame with columns channel_id and top_game.
+        timeseries_df (pl.DataFrame | pl.LazyFrame): Polars DataFrame with columns channel_id, datetime, views, subs, videos.
+    Returns:
+        games_timeseries_df (pl.DataFrame | pl.LazyFrame): The time series of each top game, lazy if any input is.
     """
-    merged_df = channels_top_game_df.join(timeseries_df, on="channel_id", how="inner")
+    merged_df = channels_top_game_df.lazy().join(timeseries_df.lazy(), on="channel_id", how="inner")
     games_timeseries_df = (
         merged_df.group_by(["top_game", "datetime"])
         .agg(
@@ -27,7 +38,75 @@ def games_timeseries(channels_top_game_df: pl.DataFrame, timeseries_df: pl.DataF
         )
         .sort(["top_game", "datetime"])
     )
-    return games_timeseries_df
+    return collect_like(games_timeseries_df, channels_top_game_df, timeseries_df)
+
+
+def build_games_rollup(
+    channels_top_game_df: pl.DataFrame, timeseries_df: pl.DataFrame, path: str = None
+) -> pl.DataFrame:
+    """
+    Pre-aggregate all the timeseries metrics for each top game at the day, week and month granularities,
+    in a single multi-threaded pass. Weeks start on Monday and months on their first day, like the
+    pandas periods used by generate_metric_for_channels.
+    Args:
+        channels_top_game_df (pl.DataFrame): Polars DataFrame with columns channel_id and top_game.
+        timeseries_df (pl.DataFrame): Polars DataFrame with columns channel_id, datetime and the metrics.
+        path (str): Parquet file to persist the rollup to. Defaults to None.
+    Returns:
+        rollup_df (pl.DataFrame): The rollup with columns granularity, top_game, period and the metrics.
+    """
+    merged_lf = channels_top_game_df.lazy().join(
+        timeseries_df.lazy(), on="channel_id", how="inner"
+    )
+    if merged_lf.collect_schema()["datetime"] == pl.String:
+        merged_lf = merged_lf.with_columns(pl.col("datetime").str.to_datetime("%Y-%m-%d %H:%M:%S"))
+
+    rollup_df = pl.concat(
+        [
+            merged_lf.group_by(
+                "top_game", pl.col("datetime").dt.truncate(every).alias("period")
+            )
+            .agg(pl.sum(metric) for metric in METRICS)
+            .select(pl.lit(granularity).alias("granularity"), pl.all())
+            for granularity, every in ROLLUP_PERIODS.items()
+        ]
+    ).sort(["granularity", "top_game", "period"]).collect()
+
+    if path:
+        rollup_df.write_parquet(path)
+    return rollup_df
+
+
+def load_games_rollup(path: str) -> pl.DataFrame:
+    """
+    Load a rollup persisted by build_games_rollup.
+    Args:
+        path (str): Parquet file of the rollup.
+    Returns:
+        rollup_df (pl.DataFrame): The rollup.
+    """
+    return pl.read_parquet(path)
+
+
+def query_games_rollup(
+    rollup_df: pl.DataFrame,
+    game_name: str,
+    period: str = "W",
+    metrics: list[str] = None,
+) -> pl.DataFrame:
+    """
+    Slice the metrics of a game at a given granularity from the rollup.
+    Args:
+        rollup_df (pl.DataFrame): The rollup returned by build_games_rollup.
+        game_name (str): The name of the game.
+        period (str): The granularity, one of 'D', 'W' or 'M'. Default is 'W' (weekly).
+        metrics (list[str]): The metrics to return. Defaults to all of them.
+    Returns:
+        game_period (pl.DataFrame): The period and the metrics of the game, sorted by period.
+    """
+    return rollup_df.filter(
+        (pl.col("granularity") == period) & (pl.col("top_game") == game_name)
+    ).select(["period"] + (metrics or METRICS))
 
 
 def generate_metric_for_channels(
@@ -41,7 +120,8 @@ def generate_metric_for_channels(
     """ "
     Generates a time series DataFrame for a specfied metric of a specified game.
         Args:
-            games_timeseries_df (pd.DataFrame): The DataFrame containing the time series data for the games.
+            games_timeseries_df (pl.DataFrame): The DataFrame containing the time series data for the games, or
+                the rollup returned by build_games_rollup.
             game_name (str): The name of the game to plot.
             dates (list[tuple[str, str]]): A list of tuples containing the event name and date.
             period (str): The period to group the data by. Default is 'W' (weekly).
@@ -57,13 +137,20 @@ def generate_metric_for_channels(
         else "delta_subs" if metric == "subs" else "delta_videos"
     )
 
-    game_df = games_timeseries_df.filter(pl.col("top_game") == game_name).to_pandas()
-    game_df["datetime"] = pd.to_datetime(game_df["datetime"])
-    game_df["period"] = game_df["datetime"].dt.to_period(period)
+    if "granularity" in games_timeseries_df.columns and period in ROLLUP_PERIODS:
+        # Slice the pre-aggregated periods
+        game_period = query_games_rollup(
+            games_timeseries_df, game_name, period, [column_name]
+        ).to_pandas()
+    else:
+        game_df = games_timeseries_df.filter(pl.col("top_game") == game_name).to_pandas()
+        if not pd.api.types.is_datetime64_any_dtype(game_df["datetime"]):
+            game_df["datetime"] = pd.to_datetime(game_df["datetime"])
+        game_df["period"] = game_df["datetime"].dt.to_period(period)
 
-    # Aggregate views by
-    game_period = game_df.groupby("period").agg({column_name: "sum"}).reset_index()
-    game_period["period"] = game_period["period"].dt.to_timestamp()
+        # Aggregate views by
+        game_period = game_df.groupby("period").agg({column_name: "sum"}).reset_index()
+        game_period["period"] = game_period["period"].dt.to_timestamp()
 
     if lower_cutoff:
         game_period = game_period[game_period["period"] >= pd.Timestamp(lower_cutoff)]
@@ -89,7 +176,8 @@ def generate_views_for_game(
     """
 
     game_df = df.filter(pl.col("video_game") == game_name).to_pandas()
-    game_df["upload_date"] = pd.to_datetime(game_df["upload_date"])
+    if not pd.api.types.is_datetime64_any_dtype(game_df["upload_date"]):
+        game_df["upload_date"] = pd.to_datetime(game_df["upload_date"])
 
     weekly_views = (
         game_df.set_index("upload_date")
@@ -103,6 +191,162 @@ def generate_views_for_game(
     return pd.DataFrame(averaged_weekly_views)
 
 
+def games_metric_matrix(
+    games_timeseries_df: pl.DataFrame, metric: str = "delta_views", period: str = "W"
+) -> pl.DataFrame:
+    """
+    Aggregate a metric of every game by period, in a matrix with one column per game on a regular period grid.
+    Args:
+        games_timeseries_df (pl.DataFrame): The output of games_timeseries, or the rollup returned by build_games_rollup.
+        metric (str): The metric to aggregate. Default is 'delta_views'.
+        period (str): The period to group the data by, one of 'D', 'W' or 'M'. Default is 'W' (weekly).
+    Returns:
+        matrix_df (pl.DataFrame): The 'period' column and one column per game, with zeros for periods without data.
+    """
+    games_lf = games_timeseries_df.lazy()
+    if "granularity" in games_lf.collect_schema().names():
+        period_lf = games_lf.filter(pl.col("granularity") == period).select("top_game", "period", metric)
+    else:
+        if games_lf.collect_schema()["datetime"] == pl.String:
+            games_lf = games_lf.with_columns(pl.col("datetime").str.to_datetime("%Y-%m-%d %H:%M:%S"))
+        period_lf = games_lf.group_by(
+            "top_game", pl.col("datetime").dt.truncate(ROLLUP_PERIODS[period]).alias("period")
+        ).agg(pl.sum(metric))
+
+    period_df = period_lf.collect()
+    grid_df = pl.select(
+        pl.datetime_range(
+            period_df.get_column("period").min(),
+            period_df.get_column("period").max(),
+            ROLLUP_PERIODS[period],
+            time_unit=period_df.schema["period"].time_unit,
+        ).alias("period")
+    )
+    return grid_df.join(
+        period_df.pivot(on="top_game", index="period", values=metric), on="period", how="left"
+    ).fill_null(0)
+
+
+def cross_correlate_games(
+    games_timeseries_df: pl.DataFrame,
+    metric: str = "delta_views",
+    period: str = "W",
+    max_lag: int = 26,
+) -> pl.DataFrame:
+    """
+    Compute the cross-correlation of a metric between every pair of games with FFTs, and find the lag at
+    which each pair is the most correlated. The series are z-normalized, so the correlations are Pearson
+    correlations over the whole period grid, zero-padded outside of the overlap of the shifted series.
+    Args:
+        games_timeseries_df (pl.DataFrame): The output of games_timeseries, or the rollup returned by build_games_rollup.
+        metric (str): The metric to correlate. Default is 'delta_views'.
+        period (str): The period to group the data by, one of 'D', 'W' or 'M'. Default is 'W' (weekly).
+        max_lag (int): The largest lag considered, in periods. Default is 26.
+    Returns:
+        correlations_df (pl.DataFrame): One row per pair of games with columns 'game_1', 'game_2', 'lag' and
+        'correlation', sorted by decreasing absolute correlation. A positive lag means that 'game_1' leads 'game_2'
+        by that number of periods.
+    """
+    matrix_df = games_metric_matrix(games_timeseries_df, metric, period).drop("period")
+    values = matrix_df.to_numpy().astype(np.float64)
+
+    # Z-normalize each game, dropping the constant ones
+    std = values.std(axis=0)
+    games = np.array(matrix_df.columns)[std > 0]
+    values = (values[:, std > 0] - values[:, std > 0].mean(axis=0)) / std[std > 0]
+    n_periods, n_games = values.shape
+    max_lag = min(max_lag, n_periods - 1)
+
+    # Zero-pad to avoid circular correlation, and keep the lags from -max_lag to max_lag
+    n_fft = 1 << (2 * n_periods - 1).bit_length()
+    spectrum = np.fft.rfft(values, n=n_fft, axis=0)
+    lags = np.concatenate([np.arange(-max_lag, 0), np.arange(0, max_lag + 1)])
+    rows = np.concatenate([np.arange(n_fft - max_lag, n_fft), np.arange(0, max_lag + 1)])
+
+    peak_lags = []
+    peak_correlations = []
+    for i in range(n_games - 1):
+        # Correlation of game i at t with every following game at t + lag
+        correlations = np.fft.irfft(np.conj(spectrum[:, [i]]) * spectrum[:, i + 1 :], n=n_fft, axis=0)[rows] / n_periods
+        peaks = np.abs(correlations).argmax(axis=0)
+        peak_lags.append(lags[peaks])
+        peak_correlations.append(correlations[peaks, np.arange(n_games - i - 1)])
+
+    first, second = np.triu_indices(n_games, k=1)
+    return pl.DataFrame(
+        {
+            "game_1": games[first],
+            "game_2": games[second],
+            "lag": np.concatenate(peak_lags or [np.empty(0, dtype=np.int64)]),
+            "correlation": np.concatenate(peak_correlations or [np.empty(0)]),
+        },
+        schema={"game_1": pl.String, "game_2": pl.String, "lag": pl.Int64, "correlation": pl.Float64},
+    ).sort(pl.col("correlation").abs(), descending=True)
+
+
+def detect_spikes(
+    timeseries_df: pl.DataFrame,
+    metrics: list[str] = None,
+    window: int = 12,
+    threshold: float = 5.0,
+    since: str = None,
+) -> pl.DataFrame:
+    """
+    Detect the spikes of the weekly metrics of every channel with a trailing robust z-score. Each week is compared
+    to the median of the previous window weeks of the channel, scaled by the median absolute deviation from it
+    over the previous window weeks.
+    Args:
+        timeseries_df (pl.DataFrame | pl.LazyFrame): Timeseries with columns channel_id, datetime and the metrics.
+        metrics (list[str]): The metrics to score. Default is ['delta_views', 'delta_subs'].
+        window (int): Number of previous weeks of the baseline. Default is 12.
+        threshold (float): Minimum absolute score of a spike. Default is 5.
+        since (str): Only score the weeks from this date, reading just the weeks of their baselines, to process
+            newly appended weeks. Defaults to None.
+    Returns:
+        spikes_df (pl.DataFrame): One row per spike with columns channel_id, datetime, metric and score.
+    """
+    metrics = metrics or ["delta_views", "delta_subs"]
+    timeseries_lf = timeseries_df.lazy().select("channel_id", "datetime", *metrics)
+    if timeseries_lf.collect_schema()["datetime"] == pl.String:
+        timeseries_lf = timeseries_lf.with_columns(pl.col("datetime").str.to_datetime("%Y-%m-%d %H:%M:%S"))
+
+    if since:
+        # The baseline of the first scored week and the deviations it is scaled by span 2 windows before it
+        since = pd.Timestamp(since)
+        timeseries_lf = timeseries_lf.filter(
+            pl.col("datetime") >= since - pd.Timedelta(weeks=2 * window + 1)
+        )
+
+    # The channels are sorted, so the rolling windows run over the whole columns and the baselines
+    # overlapping the previous channel are nulled, which is much faster than rolling over each channel
+    same_channel = pl.col("channel_id") == pl.col("channel_id").shift(window)
+    spikes_lf = (
+        timeseries_lf.sort("channel_id", "datetime")
+        .with_columns(
+            pl.when(same_channel).then(pl.col(metric).rolling_median(window).shift(1)).alias(f"{metric}_median")
+            for metric in metrics
+        )
+        .with_columns(
+            (pl.col(metric) - pl.col(f"{metric}_median")).alias(f"{metric}_deviation") for metric in metrics
+        )
+        .with_columns(
+            (1.4826 * pl.col(f"{metric}_deviation").abs().rolling_median(window).shift(1)).alias(f"{metric}_scale")
+            for metric in metrics
+        )
+        .select(
+            "channel_id",
+            "datetime",
+            *[
+                (pl.col(f"{metric}_deviation") / pl.when(pl.col(f"{metric}_scale") > 0).then(pl.col(f"{metric}_scale"))).alias(metric)
+                for metric in metrics
+            ],
+        )
+        .unpivot(index=["channel_id", "datetime"], variable_name="metric", value_name="score")
+        .filter(pl.col("score").abs() >= threshold)
+    )
+    if since:
+        spikes_lf = spikes_lf.filter(pl.col("datetime") >= since)
+    return spikes_lf.sort("channel_id", "datetime", "metric").collect()
 
 
 def game_percentage(df: pl.DataFrame, channels: bool = False):
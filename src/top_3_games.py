@@ -1,24 +1,26 @@
 import polars as pl
 import pandas as pd
 
+from src.utils import collect_like
+
 def count_videos_per_game(with_game_df: pl.DataFrame) -> pl.DataFrame:
     """
     Function to count the number of videos per game.
 
     Parameters:
-    - with_game_df (pl.DataFrame): DataFrame containing game data with 'video_game'.
+    - with_game_df (pl.DataFrame | pl.LazyFrame): DataFrame containing game data with 'video_game'.
 
     Returns:
-    - pl.DataFrame: A DataFrame containing the count of videos per game.
+    - pl.DataFrame | pl.LazyFrame: A DataFrame containing the count of videos per game, lazy if the input is.
     """
     # Group by 'video_game' and count the number of videos
-    game_counts_per_channel = with_game_df.group_by(["channel_id", "video_game"]).agg(
-        pl.count().alias("video_count")
+    game_counts_per_channel = with_game_df.lazy().group_by(["channel_id", "video_game"]).agg(
+        pl.len().alias("video_count")
     )
     game_counts_per_channel = game_counts_per_channel.sort(
         "video_count", descending=True
     )
-    return game_counts_per_channel
+    return collect_like(game_counts_per_channel, with_game_df)
 
 
 def calculate_game_channel_percentage(
@@ -30,23 +32,24 @@ def calculate_game_channel_percentage(
     Function to calculate the percentage of channels where the game is the main game.
 
     Parameters:
-    - game_counts_per_channel (pl.DataFrame): DataFrame containing the count of videos per game.
-    - main_game_per_channel (pl.DataFrame): DataFrame containing the main game per channel.
+    - game_counts_per_channel (pl.DataFrame | pl.LazyFrame): DataFrame containing the count of videos per game.
+    - main_game_per_channel (pl.DataFrame | pl.LazyFrame): DataFrame containing the main game per channel.
     - target_games (list): List of target games to consider.
 
     Returns:
-    - pl.DataFrame: A DataFrame containing the percentage of channels where the game is the main game.
+    - pl.DataFrame | pl.LazyFrame: A DataFrame containing the percentage of channels where the game is the main game,
+      lazy if any input is.
     """
     # Filter and aggregate channels having at least one video for each target game
     channels_with_game = (
-        game_counts_per_channel.filter(pl.col("video_game").is_in(target_games))
+        game_counts_per_channel.lazy().filter(pl.col("video_game").is_in(target_games))
         .group_by("video_game")
         .agg(pl.n_unique("channel_id").alias("channels_with_at_least_one_vid"))
     )
 
     # Filter and aggregate channels where the game is the main game for each target game
     main_game_counts = (
-        main_game_per_channel.filter(pl.col("top_game").is_in(target_games))
+        main_game_per_channel.lazy().filter(pl.col("top_game").is_in(target_games))
         .group_by("top_game")
         .agg(pl.n_unique("channel_id").alias("channels_with_main_game"))
     )
@@ -64,7 +67,7 @@ def calculate_game_channel_percentage(
         .alias("percentage")
     )
 
-    return result
+    return collect_like(result, game_counts_per_channel, main_game_per_channel)
 
 
 def calculate_like_dislikes_ratio(
@@ -74,17 +77,19 @@ def calculate_like_dislikes_ratio(
     Function to calculate the like/dislike ratio for the top N games.
 
     Parameters:
-    - with_game_df (pl.DataFrame): DataFrame containing game data with 'video_game', 'like_count', and 'dislike_count'.
-    - top_games_df (pl.DataFrame): DataFrame containing a list of top games.
+    - with_game_df (pl.DataFrame | pl.LazyFrame): DataFrame containing game data with 'video_game', 'like_count', and 'dislike_count'.
+    - top_games_df (pl.DataFrame | pl.LazyFrame): DataFrame containing a list of top games.
     - top_n (int): Number of top games to consider. Default is 3.
 
     Returns:
-    - pl.DataFrame: A DataFrame containing the like/dislike ratio for the top N games.
+    - pl.DataFrame | pl.LazyFrame: A DataFrame containing the like/dislike ratio for the top N games, lazy if any input is.
     """
     # Filter the dataframe for the top N games and calculate the likes/dislikes ratio for each game
     like_dislikes_ratio_df = (
-        with_game_df.filter(
-            pl.col("video_game").is_in(top_games_df["top_game"].head(top_n))
+        with_game_df.lazy().join(
+            top_games_df.lazy().head(top_n).select(pl.col("top_game").alias("video_game")),
+            on="video_game",
+            how="semi",
         )  # Filter the top games
         .group_by("video_game")  # Group by video_game
         .agg(
@@ -96,7 +101,7 @@ def calculate_like_dislikes_ratio(
         )
     )
 
-    return like_dislikes_ratio_df
+    return collect_like(like_dislikes_ratio_df, with_game_df, top_games_df)
 
 def calculate_posting_rate(df: pl.DataFrame) -> pl.DataFrame:
     """
@@ -5,6 +5,12 @@ import polars as pl
 import matplotlib.pyplot as plt
 import string
 
+# Cluster boundaries on the last number of subscribers/views of the channels
+CLUSTER_BINS = {
+    "subs": [20_000, 50_000, 100_000, 500_000],
+    "views": [200_000, 1_000_000, 10_000_000, 100_000_000],
+}
+
 def segment_channel(df: pd.DataFrame, lower_bound: int, upper_bound: float, column: str) -> pd.DataFrame:
     """
     Segment the channels based on the number of subscribers.
@@ -34,32 +40,6 @@ def preprocess_name(name: str) -> str:
     return name.lower().replace(",", " ").translate(str.maketrans('', '', string.punctuation))
 
 
-def map_to_game(title: str, tags: str, game_titles: list[str]) -> str:
-    """
-    Map the video to a game based on the title and tags.
-    
-    Args:
-        title: str - title of the video
-        tags: str - list of tags of the video
-        game_titles: list[str] - list of game titles to search for
-        
-    Returns:
-        str - name of the game if the video is related to a game, else None.
-    """
-    for game in game_titles:
-        if game in title:
-            return game
-     
-    matched_games = []
-    for game in game_titles:
-        if game in tags:
-            matched_games.append(game)
-    if len(matched_games) == 1:
-        return matched_games[0]
-    else:
-        return None
-    
-    
 def w_pbar(pbar, func):
     """
     Add a progress bar to visuallize progress of a function.
@@ -77,6 +57,71 @@ def w_pbar(pbar, func):
     return foo
 
 
+def collect_like(result_lf: pl.LazyFrame, *inputs):
+    """
+    Collect a query plan if all its inputs are eager DataFrames, and keep it lazy otherwise so that it can be
+    combined into a larger plan.
+    
+    Args:
+        result_lf: pl.LazyFrame - query plan built from the inputs
+        inputs: pl.DataFrame | pl.LazyFrame - inputs of the query plan
+    
+    Returns:
+        pl.DataFrame | pl.LazyFrame - the result, eager only if all the inputs are
+    """
+    if any(isinstance(df, pl.LazyFrame) for df in inputs):
+        return result_lf
+    return result_lf.collect()
+
+
+def collect_plans(plans: list, streaming: bool = False) -> list[pl.DataFrame]:
+    """
+    Collect several query plans at once, computing their common subplans, such as the videos with their game,
+    only once.
+    
+    Args:
+        plans: list[pl.DataFrame | pl.LazyFrame] - query plans to collect
+        streaming: bool - whether to run the plans with the streaming engine, to process larger than memory datasets
+    
+    Returns:
+        list[pl.DataFrame] - the results of the plans
+    """
+    return pl.collect_all([plan.lazy() for plan in plans], streaming=streaming)
+
+
+def to_date(column: str, dtype: pl.DataType) -> pl.Expr:
+    """
+    Convert a column to dates, only parsing it if it is still stored as a string.
+    
+    Args:
+        column: str - name of the column
+        dtype: pl.DataType - current type of the column
+    
+    Returns:
+        pl.Expr - expression of the column as dates
+    """
+    if dtype == pl.String:
+        return pl.col(column).str.to_date(format="%Y-%m-%d %H:%M:%S")
+    return pl.col(column).cast(pl.Date)
+
+
+def cluster_expr(metrics: str = "subs") -> pl.Expr:
+    """
+    Expression of the cluster number of each channel based on its last number of views/subscribers.
+    
+    Args:
+        metrics: str - metric to use for clustering, either "subs" or "views"
+    
+    Returns:
+        pl.Expr - the "cluster" column, from "1" to "5"
+    """
+    return (
+        pl.col(metrics).last().over("channel_id")
+        .cut(breaks=CLUSTER_BINS[metrics], labels=["1", "2", "3", "4", "5"])
+        .alias("cluster")
+    )
+
+
 def cluster_timeseries(
     timeseries_df: pl.DataFrame,
     metrics: str = "subs"
@@ -91,22 +136,7 @@ def cluster_timeseries(
     Returns:
         pl.DataFrame - dataframe with the cluster number for each channel
     """
-    clusters_df = timeseries_df.clone()
-    subs_df = clusters_df.unique('channel_id', keep='last').select(['channel_id', 'subs', 'views'])
-    clusters_df = clusters_df.join(subs_df, on='channel_id', suffix='_last')
-    match metrics:
-        case "subs":
-            bins = [20_000, 50_000, 100_000, 500_000]
-            clusters_df = clusters_df.with_columns(
-                pl.col("subs_last").cut(breaks=bins, labels=["1", "2", "3", "4", "5"]).alias("cluster")
-            )
-        case "views":
-            bins = [200_000, 1_000_000, 10_000_000, 100_000_000]
-            clusters_df = clusters_df.with_columns(
-                pl.col("views_last").cut(breaks=bins, labels=["1", "2", "3", "4", "5"]).alias("cluster")
-            )
-
-    return clusters_df.drop('subs_last', 'views_last')
+    return timeseries_df.with_columns(cluster_expr(metrics))
 
 
 def get_stats_per_date(
@@ -125,17 +155,49 @@ def get_stats_per_date(
     Returns:
         pl.DataFrame - dataframe with the sum of views/subs for each date
     """
-    stats_df = timeseries_df.with_columns(
-        pl.col("datetime").str.to_date(format="%Y-%m-%d %H:%M:%S"),
-    )
+    return get_clustered_stats(timeseries_df, metrics=metrics, agg_func=agg_func, by=[])
+
+
+def get_clustered_stats(
+    timeseries_df: pl.DataFrame,
+    channels_top_game_df: pl.DataFrame = None,
+    metrics: str = "delta_views",
+    agg_func: str = "sum",
+    by: list[str] = None,
+) -> pl.DataFrame:
+    """
+    Compute the sum/mean of views/subs per date of the channels of every game and cluster in a single pass.
+    Channels are clustered by their last number of subscribers for "delta_subs", and of views otherwise.
+
+    Args:
+        timeseries_df: pl.DataFrame - timeseries with the views/subs for all channels
+        channels_top_game_df: pl.DataFrame - dataframe with the top game for each channel, needed to group by "top_game"
+        metrics: str - metric to sum, either "delta_views" or "delta_subs"
+        agg_func: str - aggregation function to use for the sum, either "sum" or "mean"
+        by: list[str] - keys to group by in addition to the date, among "top_game" and "cluster", both by default
+
+    Returns:
+        pl.DataFrame - dataframe with the sum/mean of views/subs for each key and date
+    """
+    by = ["top_game", "cluster"] if by is None else by
+    stats_lf = timeseries_df.lazy()
+    if "top_game" in by:
+        stats_lf = stats_lf.join(
+            channels_top_game_df.lazy().select(["channel_id", "top_game"]), on="channel_id", how="inner"
+        )
+    if "cluster" in by:
+        stats_lf = stats_lf.with_columns(cluster_expr("subs" if metrics == "delta_subs" else "views"))
+
     return (
-         stats_df
+        stats_lf
+            .with_columns(to_date("datetime", stats_lf.collect_schema()["datetime"]))
             .filter(pl.col("datetime").is_not_null() & pl.col(metrics).is_not_null())
             .with_columns([
                 pl.col(metrics).round().cast(pl.Int64)
             ])
-            .group_by("datetime")
+            .group_by(by + ["datetime"])
             .agg(pl.col(metrics).sum() if agg_func == "sum" else pl.col(metrics).mean())
+            .collect()
     )
     
     
@@ -145,9 +207,9 @@ def plot_clusters(
     esports_df: pd.DataFrame,
     game_name: str,
     window_size: int = 6,
-    get_stats_per_date: callable = get_stats_per_date,
     agg_func: str = "sum",
     metrics: str = 'delta_views',
+    clustered_stats_df: pl.DataFrame = None,
 ) -> None:
     """
     Plot the weekly statistics for the channels of a specific game, clustered by the number of views 
@@ -159,34 +221,35 @@ def plot_clusters(
         esports_df: pd.DataFrame - dataframe with esports tournaments
         game_name: str - name of the game
         window_size: int - size of the window for the rolling average
-        get_stats_per_date: callable - function to apply to the timeseries data per date"
         agg_func: str - aggregation function to use for the sum, either "sum" or "mean"
         metrics: str - metric to sum, either "delta_views" or "delta_subs"
+        clustered_stats_df: pl.DataFrame - statistics of all games returned by get_clustered_stats for the same
+            metric and aggregation, to plot several games without recomputing them
     """
-    
-    game_channels_s = channels_top_game_df.filter(pl.col("top_game") == game_name).get_column("channel_id")
-    game_timeseries_df = cluster_timeseries(
-        timeseries_df.filter(pl.col("channel_id").is_in(game_channels_s), "subs" if metrics == "delta_subs" else "views")
-    )
+    if clustered_stats_df is None:
+        game_channels_df = channels_top_game_df.filter(pl.col("top_game") == game_name)
+        clustered_stats_df = get_clustered_stats(
+            timeseries_df.filter(pl.col("channel_id").is_in(game_channels_df.get_column("channel_id"))),
+            game_channels_df,
+            metrics=metrics,
+            agg_func=agg_func,
+        )
 
-    num_clusters = game_timeseries_df.get_column("cluster").n_unique()
+    game_stats_df = clustered_stats_df.filter(pl.col("top_game") == game_name).sort("datetime")
+    clusters = sorted(game_stats_df.get_column("cluster").unique().drop_nulls().to_list(), key=int)
+    num_clusters = len(clusters)
     tournament_dates = esports_df[esports_df["video_game"] == game_name][
         ["start_date", "end_date"]
     ]
     tournament_dates = list(zip(tournament_dates["start_date"].dt.strftime("%Y-%m-%d"), tournament_dates["end_date"].dt.strftime("%Y-%m-%d")))
-    _, axs = plt.subplots(num_clusters, 1, figsize=(15, 5 * num_clusters))
+    _, axs = plt.subplots(num_clusters, 1, figsize=(15, 5 * num_clusters), squeeze=False)
 
-    for cluster in range(1, num_clusters + 1):
-        
-        cluster_df = game_timeseries_df.filter(game_timeseries_df.get_column("cluster").cast(pl.Int64) == cluster)
-        cluster_df = get_stats_per_date(cluster_df, metrics=metrics)
+    for ax, cluster in zip(axs[:, 0], clusters):
         
-        weekly_df = cluster_df.group_by("datetime").agg(pl.col(metrics).mean()).sort("datetime")
-        weekly_df = weekly_df.with_columns(
+        weekly_df = game_stats_df.filter(pl.col("cluster") == cluster).with_columns(
             pl.col(metrics).rolling_mean(window_size).alias("rolling_average")
         )
 
-        ax = axs[cluster - 1]
         ax.plot(weekly_df["datetime"], weekly_df["rolling_average"], marker="o")
 
         for start, end in tournament_dates:
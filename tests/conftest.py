@@ -0,0 +1,5 @@
+import sys
+import os
+
+# Import the project modules as the notebooks do, from the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
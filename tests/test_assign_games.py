@@ -0,0 +1,102 @@
+import random
+import string
+
+import pandas as pd
+import polars as pl
+from tqdm import tqdm
+
+from benchmarks.filter_unique_games import filter_unique_games_previous
+
+from src.assign_games import (
+    assign_games_to_videos,
+    build_game_matcher,
+    filter_unique_games,
+    map_to_game,
+    match_game,
+    preprocess_name,
+    preprocess_name_expr,
+    preprocess_video_data,
+)
+
+
+def random_names(count, seed=0):
+    """Random names of printable characters, ASCII and not, with many Greek sigmas and case-ignorable marks."""
+    rng = random.Random(seed)
+    alphabet = [chr(code) for code in range(0x20, 0x2500) if chr(code).isprintable()]
+    greek = list("ΣΣσςΆAb1 .,'-ʰᵃ́") + list(string.punctuation)
+    names = []
+    for _ in range(count):
+        characters = alphabet if rng.random() < 0.5 else greek
+        names.append("".join(rng.choice(characters) for _ in range(rng.randint(0, 24))))
+    return names
+
+
+def test_preprocess_name_expr_matches_preprocess_name():
+    names = random_names(50_000) + [
+        "ABCDEFGHIJKLMNOPΣ",
+        "ABCDEFGHIJKLMNOPΣ ABCDEFGHIJKLMNOPΣ",
+        "ΟΔΥΣΣΕΥΣ",
+        "Σ",
+        "AΣ.Σ",
+        "AΣ́B",
+        "Counter-Strike: Global Offensive",
+    ]
+
+    processed = pl.DataFrame({"name": names}).select(preprocess_name_expr("name")).get_column("name")
+
+    assert processed.to_list() == [preprocess_name(name) for name in names]
+
+
+def test_preprocess_video_data_native_matches_custom_function():
+    tqdm.pandas()
+    names = random_names(1_000, seed=1)
+    videos_df = pl.DataFrame({"title": names, "tags": names[::-1]})
+    games_df = pd.DataFrame({"Title": ["Minecraft", "ΟΔΥΣΣΕΥΣ", "Grand Theft Auto V"]})
+
+    native_df, native_titles = preprocess_video_data(videos_df, games_df)
+    custom_df, custom_titles = preprocess_video_data(videos_df, games_df, preprocess_name)
+
+    assert native_df.equals(custom_df)
+    assert native_titles == custom_titles
+
+
+def test_assign_games_to_videos_workers_match_sequential():
+    game_titles = ["minecraft", "grand theft auto v", "fortnite", "league of legends"]
+    videos_df = pl.DataFrame(
+        {
+            "title": [f"{game_titles[i % 5] if i % 5 < 4 else 'vlog'} part {i}" for i in range(2_000)],
+            "tags": [game_titles[i % 3] if i % 7 == 0 else "" for i in range(2_000)],
+        }
+    )
+
+    sequential = assign_games_to_videos(videos_df, game_titles)
+    parallel = assign_games_to_videos(videos_df, game_titles, n_workers=2, batch_size=97)
+
+    assert parallel.name == "video_game"
+    assert parallel.equals(sequential)
+    assert assign_games_to_videos(videos_df.clear(), game_titles, n_workers=2).len() == 0
+
+
+def test_match_game_matches_map_to_game():
+    rng = random.Random(2)
+
+    def random_text(max_length):
+        return "".join(rng.choice("ab c") for _ in range(rng.randint(0, max_length)))
+
+    for _ in range(3_000):
+        # Small alphabets, so that catalogs have duplicate, empty and overlapping titles
+        game_titles = [random_text(4) for _ in range(rng.randint(0, 8))]
+        matcher = build_game_matcher(game_titles)
+        for _ in range(20):
+            title, tags = random_text(12), random_text(12)
+            assert match_game(title, tags, matcher) == map_to_game(title, tags, game_titles)
+
+
+def test_filter_unique_games_matches_previous_implementation():
+    rng = random.Random(3)
+    for _ in range(500):
+        # Small alphabets, so that catalogs have duplicate, empty and nested titles
+        titles = ["".join(rng.choice("ab ") for _ in range(rng.randint(0, 5))) for _ in range(rng.randint(1, 15))]
+        games_df = pd.DataFrame({"Title": titles, "Plays": range(len(titles))})
+
+        assert filter_unique_games(games_df).equals(filter_unique_games_previous(games_df))
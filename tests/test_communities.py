@@ -0,0 +1,25 @@
+import random
+
+import polars as pl
+
+from src.communities import compute_edge_weights, compute_edge_weights_out_of_core, map_comments_to_target
+
+
+def test_out_of_core_edge_weights_match_in_memory(tmp_path):
+    rng = random.Random(4)
+    comments_df = pl.DataFrame(
+        {
+            "author": [rng.randint(0, 3_000) for _ in range(20_000)],
+            "video_id": [f"v{rng.randint(0, 500)}" for _ in range(20_000)],
+        }
+    )
+    comments_df.write_csv(tmp_path / "comments.tsv", separator="\t")
+    display_id_to_target = {f"v{index}": rng.choice("abcdef") for index in range(400)}
+
+    expected_df = compute_edge_weights(map_comments_to_target(comments_df, display_id_to_target, "game"), "game")
+    edges_df = compute_edge_weights_out_of_core(
+        str(tmp_path / "comments.tsv"), display_id_to_target, "game", str(tmp_path / "shards"), memory_budget=50_000
+    )
+
+    assert len(list((tmp_path / "shards").iterdir())) > 1
+    assert edges_df.equals(expected_df)
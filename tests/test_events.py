@@ -0,0 +1,73 @@
+from datetime import date, datetime, timedelta
+
+import polars as pl
+
+from src.events import event_impact, event_windows
+
+
+def weekly_rollup(weeks):
+    """Weekly rollup of Fortnite over the given week numbers of 2019."""
+    periods = [datetime(2019, 1, 7) + timedelta(weeks=week) for week in weeks]
+    return pl.DataFrame(
+        {
+            "granularity": "W",
+            "top_game": "Fortnite",
+            "period": periods,
+            "delta_views": [float(week) for week in weeks],
+            "delta_subs": 1.0,
+            "delta_videos": 1,
+        }
+    )
+
+
+def tournaments(dates):
+    return pl.DataFrame(
+        {
+            "tournament_id": list(range(len(dates))),
+            "tournament": [f"Cup {index}" for index in range(len(dates))],
+            "video_game": "Fortnite",
+            "start_date": [start for start, _ in dates],
+            "end_date": [end for _, end in dates],
+        }
+    )
+
+
+def test_event_windows_leave_out_tournaments_outside_the_periods():
+    # Weeks 0 to 37 (2019-09-23), without weeks 20 to 24
+    rollup_df = weekly_rollup([week for week in range(38) if not 20 <= week < 25])
+    tournaments_df = tournaments(
+        [
+            (date(2019, 3, 5), date(2019, 3, 6)),  # Week 8
+            (date(2019, 9, 25), date(2019, 9, 29)),  # Last week
+            (date(2019, 12, 1), date(2019, 12, 3)),  # After the last week
+            (date(2019, 6, 5), date(2019, 6, 6)),  # Week 21, in the gap
+        ]
+    )
+
+    windows_df = event_windows(tournaments_df, rollup_df)
+
+    assert windows_df.get_column("tournament_id").unique().sort().to_list() == [0, 1]
+    assert windows_df.filter(pl.col("tournament_id") == 0).get_column("window").value_counts().sort(
+        "window"
+    ).rows() == [("during", 1), ("post", 4), ("pre", 4)]
+    assert windows_df.filter(
+        (pl.col("tournament_id") == 1) & (pl.col("window") == "during")
+    ).get_column("period").to_list() == [datetime(2019, 9, 23)]
+
+
+def test_event_impact_leaves_out_events_without_pre_or_post_periods():
+    rollup_df = weekly_rollup(list(range(38)))
+    events_df = tournaments(
+        [
+            (date(2019, 3, 5), date(2019, 3, 6)),  # Week 8
+            (date(2019, 9, 25), date(2019, 9, 29)),  # Last week, without post periods
+            (date(2019, 1, 8), date(2019, 1, 9)),  # First week, without pre periods
+            (date(2020, 3, 1), date(2020, 3, 2)),  # After the last week
+        ]
+    )
+
+    impact_df = event_impact(events_df, rollup_df)
+
+    assert impact_df.select("tournament_id", "n_pre", "n_post", "mean_pre", "mean_post").rows() == [
+        (0, 4, 4, 5.5, 10.5)
+    ]
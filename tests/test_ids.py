@@ -0,0 +1,37 @@
+import polars as pl
+
+from src.ids import build_id_dictionary, decode_ids, load_id_dictionary, save_id_dictionary
+from src.storage import add_id_keys, read_dataset, scan_dataset, write_dataset
+
+
+def test_store_ids_round_trip(tmp_path):
+    videos_df = pl.DataFrame(
+        {
+            "upload_date": ["2016-09-28 00:00:00", "2016-10-02 00:00:00", "2017-01-02 00:00:00"],
+            "channel_id": ["UC2", "UC1", "UC2"],
+            "display_id": ["v3", "v1", "v2"],
+        }
+    )
+    comments_df = pl.DataFrame({"author": [7, 3, 7], "video_id": ["v1", "v2", "unknown"]})
+    write_dataset(videos_df, "videos", str(tmp_path))
+    write_dataset(comments_df, "comments", str(tmp_path))
+    save_id_dictionary(build_id_dictionary(scan_dataset("videos", str(tmp_path))), str(tmp_path / "ids"))
+    id_dictionary = load_id_dictionary(str(tmp_path / "ids"))
+    add_id_keys("videos", str(tmp_path), id_dictionary)
+    add_id_keys("comments", str(tmp_path), id_dictionary)
+
+    encoded_df = read_dataset("videos", str(tmp_path), keys=True)
+    comments_lf = scan_dataset("comments", str(tmp_path), keys=True)
+
+    assert encoded_df.schema["channel_id"] == pl.UInt32
+    assert encoded_df.get_column("display_id").to_list() == [2, 0, 1]
+    assert decode_ids(encoded_df, id_dictionary).equals(read_dataset("videos", str(tmp_path)))
+    assert scan_dataset("videos", str(tmp_path)).collect_schema().names() == [
+        "upload_date",
+        "channel_id",
+        "display_id",
+        "upload_month",
+    ]
+    # Only the keys are read from the files
+    assert "video_id_key" in comments_lf.select("video_id").explain()
+    assert sorted(comments_lf.collect().get_column("video_id").to_list(), key=str) == [0, 1, None]
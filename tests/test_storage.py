@@ -0,0 +1,72 @@
+import polars as pl
+
+from src.prefiltering import VIDEOS_JSON_SCHEMA
+from src.storage import convert_tsv_to_dataset, read_dataset, read_tsv, write_dataset
+
+
+def write_videos_tsv(path):
+    """Write a filtered videos TSV the way prefiltering.ipynb does, from read_ndjson float counts."""
+    videos_df = pl.DataFrame(
+        {
+            "title": ["first video", "second video", "third video"],
+            "tags": ["a,b", "", "c"],
+            "upload_date": ["2016-09-28 00:00:00", "2017-01-02 00:00:00", "2016-09-30 00:00:00"],
+            "view_count": [1057.0, 1.0, None],
+            "like_count": [12.0, 0.0, 3.0],
+            "dislike_count": [1.0, 0.0, None],
+            "duration": [300.0, 61.0, 1200.0],
+            "channel_id": ["UC1", "UC2", "UC1"],
+            "display_id": ["v1", "v2", "v3"],
+        },
+        schema={column: dtype for column, dtype in VIDEOS_JSON_SCHEMA.items() if column != "categories"},
+    )
+    videos_df.write_csv(path, separator="\t")
+    return videos_df
+
+
+def expected_videos(videos_df):
+    """The videos as stored, with integer counts and parsed upload dates."""
+    return videos_df.with_columns(
+        pl.col("upload_date").str.to_datetime("%Y-%m-%d %H:%M:%S"),
+        pl.col("view_count", "like_count", "dislike_count", "duration").cast(pl.Int64),
+    ).sort("upload_date")
+
+
+def test_convert_videos_tsv_round_trip(tmp_path):
+    videos_df = write_videos_tsv(tmp_path / "gaming_videos.tsv")
+
+    convert_tsv_to_dataset(str(tmp_path / "gaming_videos.tsv"), "videos", str(tmp_path / "store"))
+    stored_df = read_dataset("videos", str(tmp_path / "store")).drop("upload_month")
+
+    assert stored_df.schema["view_count"] == pl.Int64
+    assert stored_df.schema["upload_date"] == pl.Datetime
+    expected_df = expected_videos(videos_df)
+    assert stored_df.select(expected_df.columns).equals(expected_df)
+
+
+def test_read_videos_tsv(tmp_path):
+    videos_df = write_videos_tsv(tmp_path / "gaming_videos.tsv")
+
+    read_df = read_tsv(str(tmp_path / "gaming_videos.tsv"), "videos")
+
+    assert read_df.equals(expected_videos(videos_df))
+
+
+def test_partition_buckets_are_stable(tmp_path):
+    timeseries_df = pl.DataFrame(
+        {
+            "channel_id": ["UCA0000000000000000000", "UCz0000000000000000000", "UC_0000000000000000000"],
+            "datetime": ["2019-01-07 00:00:00"] * 3,
+        }
+    )
+    comments_df = pl.DataFrame({"author": [3, 35, 64], "video_id": ["v1", "v2", "v3"]})
+
+    write_dataset(timeseries_df, "timeseries", str(tmp_path))
+    write_dataset(comments_df, "comments", str(tmp_path))
+
+    assert sorted(path.name for path in (tmp_path / "timeseries").iterdir()) == [
+        "channel_bucket=0",
+        "channel_bucket=19",
+        "channel_bucket=31",
+    ]
+    assert sorted(path.name for path in (tmp_path / "comments").iterdir()) == ["author_bucket=0", "author_bucket=3"]